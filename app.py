@@ -1,27 +1,57 @@
 import os
 import sys
 import json
+import threading
+import base64
+from datetime import datetime
+from functools import wraps
 from flask import (
+    Blueprint,
     Flask,
+    Response,
+    current_app,
     request,
     abort,
-    jsonify
+    g,
+    stream_with_context
 )
-from flask_sqlalchemy import SQLAlchemy
 from flask_cors import CORS
-from models import db, setup_db, db_drop_and_create_all, Movie, Actor, Cast
-from auth import AuthError, requires_auth, AUTH0_DOMAIN, ALGORITHMS, \
-    API_AUDIENCE, AUTH0_CLIENT_ID, AUTH0_CALLBACK_URL
+from sqlalchemy import DateTime, Integer, String, tuple_, literal, and_, func
+from sqlalchemy.orm import load_only, undefer, selectinload
+from models import db, setup_db, db_drop_and_create_all, Movie, Actor, Cast, \
+    RowCount, cast_graph
+from cache import page_cache
+from pool import pool_status
+from replicas import DATABASE_REPLICA_URLS, replica_may_lag
+from serializers import jsonify, get_serializer, JSON_PRETTYPRINT
+import auth
+from auth import AuthError, requires_auth
 
 # True: development, False: production
 is_dev = True
 
 
-def create_app(test_config=None):
-    # create and configure the app
+# routes, error handlers and response headers of the API
+api = Blueprint('api', __name__)
+
+
+def create_app(config=None):
+    '''
+    Builds an app serving the API
+        config: mapping of Flask config values, e.g.
+        SQLALCHEMY_DATABASE_URI (default: the DATABASE_URL environment
+        variable), DATABASE_REPLICA_URLS (a list of URLs) and
+        JSONIFY_PRETTYPRINT_REGULAR (default: JSON_PRETTYPRINT)
+    '''
     flask_app = Flask(__name__)
-    setup_db(flask_app)
+    flask_app.config['JSONIFY_PRETTYPRINT_REGULAR'] = JSON_PRETTYPRINT
+    flask_app.config.from_mapping(config or {})
+    setup_db(flask_app,
+             flask_app.config.get('SQLALCHEMY_DATABASE_URI'),
+             flask_app.config.get('DATABASE_REPLICA_URLS',
+                                  DATABASE_REPLICA_URLS))
     CORS(flask_app)
+    flask_app.register_blueprint(api)
     # Uncomment the following line to initialize the datbase
     # !! NOTE THIS WILL DROP ALL RECORDS AND START YOUR DB FROM SCRATCH
     # !! NOTE THIS MUST BE UNCOMMENTED ON FIRST RUN
@@ -30,20 +60,67 @@ def create_app(test_config=None):
     return flask_app
 
 
-app = create_app()
+_app_lock = threading.Lock()
+
+
+def get_app():
+    '''
+    The app of the servers (gunicorn app:app, asgi.py, manage.py), created
+    by create_app() on first use instead of at import
+    '''
+    with _app_lock:
+        if 'app' not in globals():
+            globals()['app'] = create_app()
+    return globals()['app']
+
 
+def __getattr__(name):
+    # `from app import app` (PEP 562)
+    if name == 'app':
+        return get_app()
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+
+def warm_up(flask_app=None):
+    '''
+    Fetches the JWKS and opens the pooled DB connections ahead of traffic,
+    so the first requests wait on neither. failures are printed and left
+    to the requests to retry.
+    '''
+    if flask_app is None:
+        flask_app = get_app()
+
+    try:
+        if auth.jwks_cache.is_stale():
+            auth.jwks_cache.refresh()
+    except Exception:
+        print(sys.exc_info())
 
-@app.after_request
+    try:
+        with flask_app.app_context():
+            pool = db.engine.pool
+            size = pool.size() if hasattr(pool, 'size') else 1
+            connections = [db.engine.connect() for _ in range(size)]
+            for connection in connections:
+                connection.close()
+    except Exception:
+        print(sys.exc_info())
+
+
+@api.after_app_request
 def after_request(response):
     response.headers.add('Access-Control-Allow-Origions', '*')  # ?
     response.headers.add('Access-Control-Allow-Headers',
                          'Content-Type, Authorization, true')
     response.headers.add('Access-Control-Allow-Methods',
                          'GET, POST, PATCH, DELETE, OPTIONS')
+    # strong ETag of a collection response, see conditional_get
+    if response.status_code in (200, 304) and 'etag' in g:
+        response.set_etag(g.etag)
     return response
 
 
-@app.route('/')
+@api.route('/')
 def get_greeting():
     greeting = "Hello"
 
@@ -53,13 +130,13 @@ def get_greeting():
     })
 
 
-@app.route("/login", methods=["GET"])
+@api.route("/login", methods=["GET"])
 def generate_login_url():
-    login_url = f'https://{AUTH0_DOMAIN}/authorize' \
-        f'?audience={API_AUDIENCE}' \
+    login_url = f'https://{auth.AUTH0_DOMAIN}/authorize' \
+        f'?audience={auth.API_AUDIENCE}' \
         f'&response_type=token&client_id=' \
-        f'{AUTH0_CLIENT_ID}&redirect_uri=' \
-        f'{AUTH0_CALLBACK_URL}'
+        f'{auth.AUTH0_CLIENT_ID}&redirect_uri=' \
+        f'{auth.AUTH0_CALLBACK_URL}'
 
     print('login url:', login_url)
 
@@ -70,32 +147,650 @@ def generate_login_url():
 
 MOVIES_PER_PAGE = 10
 ACTORS_PER_PAGE = 10
+MAX_PER_PAGE = 100
+# rows fetched per round trip from the server-side cursor of an export
+EXPORT_BATCH_SIZE = 1000
+# rows inserted per executemany/transaction by the bulk create endpoints
+BULK_CHUNK_SIZE = 1000
+# range of the Integer columns
+INTEGER_MIN = -2 ** 31
+INTEGER_MAX = 2 ** 31 - 1
+# largest OFFSET the database takes (bigint)
+MAX_OFFSET = 2 ** 63 - 1
+
+
+# sort orders of the list endpoints, each is paired with id as tie-breaker.
+# only keys backed by a (key, id) index are allowed, so no request can make
+# the database sort a whole table.
+MOVIE_SORT_KEYS = {
+    'id': Movie.id,
+    'title': Movie.title,
+    'release_date': Movie.release_date
+}
+ACTOR_SORT_KEYS = {
+    'id': Actor.id,
+    'name': Actor.name,
+    'age': Actor.age
+}
+
+
+def count_rows(model, condition=None):
+    '''
+    Total rows of the model, `count=estimate` trades exactness for speed
+        with a filter `condition` the matching rows are counted instead,
+        with an indexed COUNT. there is no estimate of a filtered count, so
+        `count=estimate` with filters aborts with 400.
+    '''
+    count = request.args.get('count', 'exact')
+    if count not in ('exact', 'estimate'):
+        abort(400)
+
+    if condition is not None:
+        if count == 'estimate':
+            abort(400)
+        return db.session.query(func.count(model.id)) \
+            .filter(condition).scalar()
+    return model.count(estimate=count == 'estimate')
+
+
+def get_fields(model):
+    '''
+    Returns the fields requested with `fields` (comma separated), or all
+    fields of the model. Aborts with 400 on an unknown field.
+    '''
+    fields = request.args.get('fields')
+    if not fields:
+        return model.FIELDS
+
+    fields = tuple(dict.fromkeys(field for field in fields.split(',')
+                                 if field))
+    if not fields or not set(fields) <= set(model.FIELDS):
+        abort(400)
+
+    return fields
+
+
+def get_include(relationship):
+    '''
+    Whether the request expands `relationship` with `include`, aborts with
+    400 on any other value
+    '''
+    include = request.args.get('include')
+    if include is None:
+        return False
+    if include != relationship:
+        abort(400)
+
+    return True
+
+
+def select_fields(model, fields):
+    '''Query of the model loading only the columns of `fields` (and id)'''
+    return model.query.options(load_only(*fields))
+
+
+def search_page(model, default_per_page):
+    '''
+    Returns one page of the rows matching `q`, best match first (see
+    ExtendedBaseModelClass.search), with the `fields` of the request.
+    Aborts with 400 on a missing or blank `q`, with 404 when no row matches.
+    '''
+    text_query = request.args.get('q', '').strip()
+    if not text_query:
+        abort(400)
+
+    fields = get_fields(model)
+    query = model.search(text_query).options(load_only(*fields))
+    items = paginate(query, default_per_page)
+    if len(items) == 0:
+        abort(404)
+
+    return get_serializer(model, fields).many(items)
+
+
+def export_ndjson(model):
+    '''
+    Streams all rows of the model, ordered by id, as newline-delimited JSON
+        rows are read in EXPORT_BATCH_SIZE batches through a server-side
+        cursor (stream_results), so memory stays flat and the first line
+        is sent before the whole table has been read.
+    '''
+    fields = get_fields(model)
+    selection = select_fields(model, fields).order_by(model.id) \
+        .execution_options(stream_results=True) \
+        .yield_per(EXPORT_BATCH_SIZE)
+
+    encode = get_serializer(model, fields).encode
+
+    def generate():
+        for item in selection:
+            yield encode(item) + b'\n'
+
+    return Response(stream_with_context(generate()),
+                    mimetype='application/x-ndjson')
+
+
+def get_bulk_items():
+    '''
+    Returns the items of a bulk request body: a JSON array, or one JSON
+    object per line with Content-Type application/x-ndjson. A line that is
+    not valid JSON is returned as an exception, to be reported per item.
+    Aborts with 400 if the body is neither.
+    '''
+    if request.mimetype == 'application/x-ndjson':
+        items = []
+        for line in request.get_data(as_text=True).splitlines():
+            if not line.strip():
+                continue
+            try:
+                items.append(json.loads(line))
+            except ValueError as ex:
+                items.append(ex)
+
+    else:
+        items = request.get_json(silent=True)
+
+    if not isinstance(items, list) or len(items) == 0:
+        abort(400)
+
+    return items
+
+
+def bulk_create(model, parse_item):
+    '''
+    Inserts the items of the request body in BULK_CHUNK_SIZE chunks, one
+    transaction per chunk. Invalid items are skipped and reported with
+    their index, so one bad item does not fail the batch. a chunk the
+    database rejects is inserted again row by row, so only the rows it
+    rejects are reported.
+    '''
+    created = 0
+    errors = []
+    chunk = []
+    chunk_indexes = []
+
+    def insert(rows):
+        try:
+            model.bulk_insert(rows)
+            return True
+        except Exception:
+            db.session.rollback()
+            print(sys.exc_info())
+            return False
+
+    def flush():
+        nonlocal created
+        if insert(chunk):
+            created += len(chunk)
+        else:
+            for index, row in zip(chunk_indexes, chunk):
+                if insert([row]):
+                    created += 1
+                else:
+                    errors.append({'index': index, 'error': 'unprocessable'})
+        chunk.clear()
+        chunk_indexes.clear()
+
+    for index, item in enumerate(get_bulk_items()):
+        try:
+            if isinstance(item, Exception):
+                raise ValueError('Invalid JSON.')
+            chunk.append(parse_item(item))
+            chunk_indexes.append(index)
+        except (ValueError, TypeError, OverflowError) as ex:
+            errors.append({'index': index, 'error': str(ex)})
+            continue
+
+        if len(chunk) == BULK_CHUNK_SIZE:
+            flush()
+
+    if chunk:
+        flush()
+
+    errors.sort(key=lambda error: error['index'])
+    return created, errors
+
+
+def parse_movie(item):
+    '''Returns the row of a bulk movie item, raises ValueError if invalid'''
+    if not isinstance(item, dict):
+        raise ValueError('Item must be an object.')
+
+    title = item.get('title')
+    if title is not None and not isinstance(title, str):
+        raise ValueError('title must be a string.')
+
+    release_date = item.get('release_date')
+    if release_date is not None:
+        try:
+            release_date = parse_date(release_date)
+        except (ValueError, TypeError, OverflowError):
+            raise ValueError('release_date must be a date.')
+
+    return {'title': title, 'release_date': release_date}
+
+
+def parse_actor(item):
+    '''Returns the row of a bulk actor item, raises ValueError if invalid'''
+    if not isinstance(item, dict):
+        raise ValueError('Item must be an object.')
+
+    name = item.get('name')
+    if name is not None and not isinstance(name, str):
+        raise ValueError('name must be a string.')
+
+    age = item.get('age')
+    if age is not None:
+        # bool is an int, and int() would truncate floats
+        if isinstance(age, (bool, float)):
+            raise ValueError('age must be an integer.')
+        try:
+            age = int(age)
+        except (ValueError, TypeError):
+            raise ValueError('age must be an integer.')
+        if not INTEGER_MIN <= age <= INTEGER_MAX:
+            raise ValueError('age is out of range.')
+
+    gender = item.get('gender')
+    if gender is not None and not isinstance(gender, str):
+        raise ValueError('gender must be a string.')
+
+    return {'name': name, 'age': age, 'gender': gender}
+
+
+# filters of the list and bulk PATCH/DELETE endpoints,
+# name -> SQL predicate builder
+def parse_date(value):
+    # dateutil is imported on first use, it is slow to import
+    from dateutil import parser as date_parser
+    return date_parser.parse(value)
+
+
+MOVIE_FILTERS = {
+    'title': lambda value: Movie.title == value,
+    'title_prefix':
+        lambda value: Movie.title.startswith(value, autoescape=True),
+    'release_date_from':
+        lambda value: Movie.release_date >= parse_date(value),
+    'release_date_to':
+        lambda value: Movie.release_date <= parse_date(value)
+}
+ACTOR_FILTERS = {
+    'name': lambda value: Actor.name == value,
+    'gender': lambda value: Actor.gender == value,
+    'age_min': lambda value: Actor.age >= int(value),
+    'age_max': lambda value: Actor.age <= int(value)
+}
+
+
+def get_filter_condition(filters):
+    '''
+    Returns the WHERE condition of the `filters` given as query parameters,
+    or None if there are none. Aborts with 400 on an invalid value.
+    '''
+    conditions = []
+    for name, build_condition in filters.items():
+        value = request.args.get(name)
+        if value is None:
+            continue
+        try:
+            conditions.append(build_condition(value))
+        except (ValueError, TypeError, OverflowError):
+            abort(400)
+
+    if len(conditions) == 0:
+        return None
+
+    return and_(*conditions)
+
+
+def get_bulk_condition(model, filters):
+    '''
+    Returns the WHERE condition of a bulk request body
+        `ids`: list of ids, and/or `filter`: object of `filters` names to
+        values. Aborts with 400 if neither is given, so a bulk request
+        never targets a whole table by accident.
+    '''
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict):
+        abort(400)
+
+    conditions = []
+    ids = body.get('ids')
+    if ids is not None:
+        if not isinstance(ids, list) or len(ids) == 0 or \
+                not all(isinstance(item_id, int) for item_id in ids):
+            abort(400)
+        conditions.append(model.id.in_(ids))
+
+    filter_values = body.get('filter')
+    if filter_values is not None:
+        if not isinstance(filter_values, dict) or len(filter_values) == 0:
+            abort(400)
+        try:
+            conditions.extend(filters[name](value)
+                              for name, value in filter_values.items())
+        except (KeyError, ValueError, TypeError, OverflowError):
+            abort(400)
+
+    if len(conditions) == 0:
+        abort(400)
+
+    return and_(*conditions)
+
+
+def get_bulk_values(parse_item):
+    '''
+    Returns the validated column values of the `set` object of the body
+        like the single PATCH endpoints, a bulk update cannot clear a field,
+        null values are rejected with 422.
+    '''
+    values = request.get_json().get('set')
+    if not isinstance(values, dict) or len(values) == 0:
+        abort(400)
+
+    try:
+        row = parse_item(values)
+    except ValueError:
+        abort(422)
+    if not set(values) <= set(row):
+        abort(400)
+    if any(row[name] is None for name in values):
+        abort(422)
+
+    return {name: row[name] for name in values}
+
+
+def get_per_page(default_per_page):
+    per_page = request.args.get('per_page', default_per_page, type=int)
+    return min(max(per_page, 1), MAX_PER_PAGE)
+
+
+def get_sort(sort_keys):
+    '''Returns the `sort` key of the request, aborts with 400 if unknown'''
+    sort = request.args.get('sort', 'id')
+    if sort not in sort_keys:
+        abort(400)
+
+    return sort
+
 
+def order_by_sort(query, sort_keys):
+    '''Orders the query by the requested `sort` key, then by id'''
+    column = sort_keys[get_sort(sort_keys)]
+    id_column = sort_keys['id']
+    if column is id_column:
+        return query.order_by(id_column)
 
-def paginate(items, max_per_page):
+    return query.order_by(column, id_column)
+
+
+def paginate(query, default_per_page):
+    '''
+    Returns one page of the query results
+        the page is cut in SQL with LIMIT/OFFSET, so only the rows of the
+        page are loaded. `per_page` is clamped to MAX_PER_PAGE. a page past
+        MAX_OFFSET is empty without a query.
+    '''
     page = request.args.get('page', 1, type=int)
-    start = (page - 1) * max_per_page
-    end = start + max_per_page
-    return items[start:end]
+    per_page = get_per_page(default_per_page)
+    offset = (page - 1) * per_page
+    if page < 1 or offset > MAX_OFFSET:
+        return []
+
+    return query.limit(per_page).offset(offset).all()
+
+
+def encode_cursor(sort, last_value, last_id):
+    if isinstance(last_value, datetime):
+        last_value = last_value.isoformat()
+    raw = json.dumps([sort, last_value, last_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def is_integer(value):
+    '''Whether value fits an Integer column, bools excluded'''
+    return isinstance(value, int) and not isinstance(value, bool) and \
+        INTEGER_MIN <= value <= INTEGER_MAX
+
+
+def parse_cursor_value(value, column_type):
+    '''
+    Value of a cursor for a column of column_type
+        raises ValueError when it does not fit the column, so it never
+        reaches the database as a literal of the wrong type.
+    '''
+    if isinstance(column_type, DateTime):
+        return datetime.fromisoformat(value)
+    if isinstance(column_type, Integer) and is_integer(value):
+        return value
+    if isinstance(column_type, String) and isinstance(value, str) and \
+            '\x00' not in value:
+        return value
 
+    raise ValueError(f'Invalid cursor value {value!r}')
 
-@app.route('/movies', methods=['GET'])
+
+def decode_cursor(cursor, sort_keys):
+    '''Returns (sort, last value, last id), aborts with 400 if malformed'''
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        sort, last_value, last_id = json.loads(raw)
+        if sort not in sort_keys or not is_integer(last_id):
+            abort(400)
+        if last_value is not None:
+            last_value = parse_cursor_value(last_value, sort_keys[sort].type)
+    except (ValueError, TypeError):
+        abort(400)
+
+    return sort, last_value, last_id
+
+
+def paginate_keyset(query, sort_keys, default_per_page):
+    '''
+    Returns one page of the query results after `cursor`, and the cursor
+    of the next page (None on the last page)
+        WHERE (sort key, id) > (last sort key, last id)
+        ORDER BY sort key, id LIMIT n
+    so page 10,000 costs the same as page 1. Rows with a NULL sort key
+    come last, ordered by id. The first page is requested with an empty
+    `cursor` and a `sort` key from `sort_keys`; later cursors carry the
+    sort key themselves.
+    '''
+    per_page = get_per_page(default_per_page)
+    cursor = request.args.get('cursor', '')
+    id_column = sort_keys['id']
+
+    if cursor:
+        sort, last_value, last_id = decode_cursor(cursor, sort_keys)
+    else:
+        sort, last_value, last_id = get_sort(sort_keys), None, None
+    column = sort_keys[sort]
+    # the cursor needs the sort key even when it is not a requested field
+    query = query.options(undefer(column.key))
+
+    # one row more than the page to know whether there is a next page
+    limit = per_page + 1
+    if column is id_column:
+        selection = query.order_by(id_column)
+        if cursor:
+            selection = selection.filter(id_column > last_id)
+        items = selection.limit(limit).all()
+
+    else:
+        items = []
+        if not cursor or last_value is not None:
+            selection = query.filter(column.isnot(None)) \
+                .order_by(column, id_column)
+            if cursor:
+                selection = selection.filter(
+                    tuple_(column, id_column) >
+                    tuple_(literal(last_value, column.type), last_id))
+            items = selection.limit(limit).all()
+
+        if len(items) < limit:
+            selection = query.filter(column.is_(None)).order_by(id_column)
+            if cursor and last_value is None:
+                selection = selection.filter(id_column > last_id)
+            items += selection.limit(limit - len(items)).all()
+
+    next_cursor = None
+    if len(items) > per_page:
+        items = items[:per_page]
+        last_item = items[-1]
+        next_cursor = encode_cursor(sort, getattr(last_item, column.key),
+                                    last_item.id)
+
+    return items, next_cursor
+
+
+def get_dependencies(model, include):
+    '''Models whose rows end up in the response, see `include`'''
+    if 'include' in request.args:
+        return (model,) + include
+    return (model,)
+
+
+def get_versions(dependencies):
+    '''
+    RowCount versions of the tables, read once per request
+        conditional_get and cached_page share them, so a page is never
+        served under an ETag of other versions than the ones it is cached
+        under.
+    '''
+    if 'table_versions' not in g:
+        g.table_versions = tuple(RowCount.get_versions(dependencies))
+    return g.table_versions
+
+
+def cached_page(model, include=()):
+    '''
+    Serves the view's successful responses from page_cache
+        the cache key is the table versions (RowCount.version) plus the
+        query parameters, so a write to the table, by any process, makes its
+        cached pages unreachable. the tables of `include` count only when
+        the request expands relationships. a page read from a replica that
+        may not have the process's last write yet is not cached.
+    '''
+    def cached_page_decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            # read the versions before the query, so a write racing with it
+            # leaves the page under an outdated key
+            dependencies = get_dependencies(model, include)
+            versions = get_versions(dependencies)
+            key = page_cache.make_key(model.__tablename__, versions,
+                                      request.args)
+            body = page_cache.get(key)
+            if body is not None:
+                return current_app.response_class(
+                    body, mimetype='application/json')
+
+            response = f(*args, **kwargs)
+            if response.status_code == 200 and not replica_may_lag():
+                page_cache.set(key, response.get_data())
+
+            return response
+
+        return wrapper
+    return cached_page_decorator
+
+
+def conditional_get(model, include=()):
+    '''
+    Answers a matching If-None-Match with 304 Not Modified
+        the ETag is made of the change versions (RowCount.version) of the
+        tables in the response, which every write bumps, so the check is a
+        single primary key lookup and neither the list query nor
+        serialisation run for a 304. no ETag is given while the replica of
+        the request may miss the process's last write, as its body could be
+        older than a page served under the same versions.
+    '''
+    def conditional_get_decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            if replica_may_lag():
+                return f(*args, **kwargs)
+
+            dependencies = get_dependencies(model, include)
+            versions = get_versions(dependencies)
+            g.etag = '.'.join(f'{dependency.__tablename__}-{version}'
+                              for dependency, version
+                              in zip(dependencies, versions))
+            if request.if_none_match.contains(g.etag):
+                return current_app.response_class(status=304)
+
+            return f(*args, **kwargs)
+
+        return wrapper
+    return conditional_get_decorator
+
+
+@api.route('/movies', methods=['GET'])
 @requires_auth('get:movies')
+@conditional_get(Movie, include=(Cast, Actor))
+@cached_page(Movie, include=(Cast, Actor))
 def get_movies(jwt):
-    selection = Movie.query.order_by(Movie.id).all()
-    current_movies = [movie.get_dict()
-                      for movie in paginate(selection, MOVIES_PER_PAGE)]
-    if len(current_movies) == 0:
+    fields = get_fields(Movie)
+    query = select_fields(Movie, fields)
+    condition = get_filter_condition(MOVIE_FILTERS)
+    if condition is not None:
+        query = query.filter(condition)
+    include_actors = get_include('actors')
+    if include_actors:
+        # two batched queries per page (casts, actors) instead of N+1
+        query = query.options(
+            selectinload(Movie.casts).selectinload(Cast.actor))
+    next_cursor = None
+    if 'cursor' in request.args:
+        selection, next_cursor = paginate_keyset(
+            query, MOVIE_SORT_KEYS, MOVIES_PER_PAGE)
+    else:
+        selection = paginate(order_by_sort(query, MOVIE_SORT_KEYS),
+                             MOVIES_PER_PAGE)
+    if len(selection) == 0:
         abort(404)
+    serializer = get_serializer(Movie, fields)
+    if include_actors:
+        # rows extended with their actors are serialised as dicts
+        actor_serializer = get_serializer(Actor)
+        current_movies = []
+        for movie in selection:
+            movie_dict = serializer.to_dict(movie)
+            movie_dict['actors'] = [
+                actor_serializer.to_dict(cast.actor)
+                for cast in sorted(movie.casts, key=lambda c: c.actor_id)]
+            current_movies.append(movie_dict)
+    else:
+        current_movies = serializer.many(selection)
 
-    return jsonify({
+    response = {
         'success': True,
         'movies': current_movies,
-        'total_movies': len(selection)
+        'total_movies': count_rows(Movie, condition)
+    }
+    if 'cursor' in request.args:
+        response['next_cursor'] = next_cursor
+
+    return jsonify(response)
+
+
+@api.route('/movies/export', methods=['GET'])
+@requires_auth('get:movies')
+def export_movies(jwt):
+    return export_ndjson(Movie)
+
+
+@api.route('/movies/search', methods=['GET'])
+@requires_auth('get:movies')
+def search_movies(jwt):
+    return jsonify({
+        'success': True,
+        'movies': search_page(Movie, MOVIES_PER_PAGE)
     })
 
 
-@app.route('/movies', methods=['POST'])
+@api.route('/movies', methods=['POST'])
 @requires_auth('post:movies')
 def create_movie(jwt):
     body = request.get_json()
@@ -112,15 +807,15 @@ def create_movie(jwt):
         )
         movie.insert()
 
-        selection = Movie.query.order_by(Movie.id).all()
-        current_movies = [movie.get_dict()
-                          for movie in paginate(selection, MOVIES_PER_PAGE)]
+        selection = Movie.query.order_by(Movie.id)
+        current_movies = get_serializer(Movie).many(
+            paginate(selection, MOVIES_PER_PAGE))
 
         return jsonify({
             'success': True,
             'created': movie.id,
             'movies': current_movies,
-            'total_movies': len(Movie.query.all())
+            'total_movies': count_rows(Movie)
         })
 
     except Exception as ex:
@@ -129,82 +824,226 @@ def create_movie(jwt):
         abort(422)
 
 
-@app.route('/movies/<int:movie_id>', methods=['PATCH'])
+@api.route('/movies/bulk', methods=['POST'])
+@requires_auth('post:movies')
+def create_movies(jwt):
+    created, errors = bulk_create(Movie, parse_movie)
+
+    return jsonify({
+        'success': True,
+        'created': created,
+        'errors': errors,
+        'total_movies': count_rows(Movie)
+    })
+
+
+@api.route('/movies/bulk', methods=['PATCH'])
+@requires_auth('patch:movies')
+def update_movies(jwt):
+    condition = get_bulk_condition(Movie, MOVIE_FILTERS)
+    values = get_bulk_values(parse_movie)
+
+    try:
+        updated = Movie.bulk_update(condition, values)
+
+    except Exception as ex:
+        db.session.rollback()
+        print(sys.exc_info())
+        abort(422)
+
+    if updated == 0:
+        abort(404)
+
+    return jsonify({
+        'success': True,
+        'updated': updated
+    })
+
+
+@api.route('/movies/bulk', methods=['DELETE'])
+@requires_auth('delete:movies')
+def delete_movies(jwt):
+    condition = get_bulk_condition(Movie, MOVIE_FILTERS)
+
+    try:
+        deleted = Movie.bulk_delete(condition)
+
+    except Exception as ex:
+        db.session.rollback()
+        print(sys.exc_info())
+        abort(422)
+
+    if deleted == 0:
+        abort(404)
+
+    return jsonify({
+        'success': True,
+        'deleted': deleted
+    })
+
+
+@api.route('/movies/<int:movie_id>', methods=['PATCH'])
 @requires_auth('patch:movies')
 def update_movie(jwt, movie_id):
     body = request.get_json()
 
-    movie = Movie.query.filter(Movie.id == movie_id).one_or_none()
+    try:
+        new_title = body.get('title')
+        new_release_date = body.get('release_date')
+
+        # fields left out (or empty) keep their value
+        values = {}
+        if new_title:
+            values['title'] = new_title
+        if new_release_date:
+            values['release_date'] = new_release_date
+
+        # one UPDATE ... RETURNING, the row is not read before or after
+        movie = Movie.update_by_id(movie_id, values)
+
+    except Exception as ex:
+        db.session.rollback()
+        print(sys.exc_info())
+        abort(422)
+
     if movie is None:
         return jsonify({
             'success': False,
             'error': 'Movie id ' + str(movie_id) + ' not found to be edited.'
         }), 404
 
-    else:
-        try:
-            new_title = body.get('title')
-            new_release_date = body.get('release_date')
-
-            movie.title = new_title or movie.title
-            movie.release_date = new_release_date or movie.release_date
-
-            movie.update()
-
-            return jsonify({
-                'success': True,
-                'updated_id': movie.id,
-                'updated_movie': movie.get_dict()
-            })
-
-        except Exception as ex:
-            db.session.rollback()
-            print(sys.exc_info())
-            abort(422)
+    return jsonify({
+        'success': True,
+        'updated_id': movie.id,
+        # the serializer only reads attributes, so it takes the row as well
+        'updated_movie': get_serializer(Movie).to_json(movie)
+    })
 
 
-@app.route('/movies/<int:movie_id>', methods=['DELETE'])
+@api.route('/movies/<int:movie_id>', methods=['DELETE'])
 @requires_auth('delete:movies')
 def delete_movie(jwt, movie_id):
-    movie = Movie.query.filter(Movie.id == movie_id).one_or_none()
+    try:
+        # one DELETE ... RETURNING, the row is not read first
+        movie = Movie.delete_by_id(movie_id)
+
+    except Exception as ex:
+        db.session.rollback()
+        print(sys.exc_info())
+        abort(422)
+
     if movie is None:
         return jsonify({
             'success': False,
             'error': 'Movie id ' + str(movie_id) + ' not found to be deleted.'
         }), 404
 
+    return jsonify({
+        'success': True,
+        'deleted_id': movie_id
+    })
+
+
+@api.route('/actors', methods=['GET'])
+@requires_auth('get:actors')
+@conditional_get(Actor, include=(Cast, Movie))
+@cached_page(Actor, include=(Cast, Movie))
+def get_actors(jwt):
+    fields = get_fields(Actor)
+    query = select_fields(Actor, fields)
+    condition = get_filter_condition(ACTOR_FILTERS)
+    if condition is not None:
+        query = query.filter(condition)
+    include_movies = get_include('movies')
+    if include_movies:
+        # two batched queries per page (casts, movies) instead of N+1
+        query = query.options(
+            selectinload(Actor.casts).selectinload(Cast.movie))
+    next_cursor = None
+    if 'cursor' in request.args:
+        selection, next_cursor = paginate_keyset(
+            query, ACTOR_SORT_KEYS, ACTORS_PER_PAGE)
     else:
-        try:
-            movie.delete()
+        selection = paginate(order_by_sort(query, ACTOR_SORT_KEYS),
+                             ACTORS_PER_PAGE)
+    if len(selection) == 0:
+        abort(404)
+    serializer = get_serializer(Actor, fields)
+    if include_movies:
+        # rows extended with their movies are serialised as dicts
+        movie_serializer = get_serializer(Movie)
+        current_actors = []
+        for actor in selection:
+            actor_dict = serializer.to_dict(actor)
+            actor_dict['movies'] = [
+                movie_serializer.to_dict(cast.movie)
+                for cast in sorted(actor.casts, key=lambda c: c.movie_id)]
+            current_actors.append(actor_dict)
+    else:
+        current_actors = serializer.many(selection)
 
-            return jsonify({
-                'success': True,
-                'deleted_id': movie_id
-            })
+    response = {
+        'success': True,
+        'actors': current_actors,
+        'total_actors': count_rows(Actor, condition)
+    }
+    if 'cursor' in request.args:
+        response['next_cursor'] = next_cursor
 
-        except Exception as ex:
-            db.session.rollback()
-            print(sys.exc_info())
-            abort(422)
+    return jsonify(response)
 
 
-@app.route('/actors', methods=['GET'])
+@api.route('/actors/export', methods=['GET'])
 @requires_auth('get:actors')
-def get_actors(jwt):
-    selection = Actor.query.order_by(Actor.id).all()
-    current_actors = [actor.get_dict()
-                      for actor in paginate(selection, MOVIES_PER_PAGE)]
-    if len(current_actors) == 0:
+def export_actors(jwt):
+    return export_ndjson(Actor)
+
+
+@api.route('/actors/search', methods=['GET'])
+@requires_auth('get:actors')
+def search_actors(jwt):
+    return jsonify({
+        'success': True,
+        'actors': search_page(Actor, ACTORS_PER_PAGE)
+    })
+
+
+@api.route('/actors/<int:actor_id>/costars', methods=['GET'])
+@requires_auth('get:actors')
+def get_costars(jwt, actor_id):
+    costars = cast_graph.costars(actor_id)
+    # the graph only knows actors with casts, tell unknown ids apart
+    if len(costars) == 0 and \
+            db.session.query(Actor.id).filter_by(id=actor_id).first() is None:
         abort(404)
 
     return jsonify({
         'success': True,
-        'actors': current_actors,
-        'total_actors': len(selection)
+        'actor_id': actor_id,
+        'costars': [{'id': costar_id, 'shared_movies': shared_movies}
+                    for costar_id, shared_movies in costars],
+        'total_costars': len(costars)
+    })
+
+
+@api.route('/actors/<int:actor_id>/path/<int:other_actor_id>',
+           methods=['GET'])
+@requires_auth('get:actors')
+def get_collaboration_path(jwt, actor_id, other_actor_id):
+    path = cast_graph.shortest_path(actor_id, other_actor_id)
+    if path is None:
+        abort(404)
+
+    actor_ids, movie_ids = path
+    return jsonify({
+        'success': True,
+        'actor_ids': actor_ids,
+        'movie_ids': movie_ids,
+        'distance': len(movie_ids)
     })
 
 
-@app.route('/actors', methods=['POST'])
+@api.route('/actors', methods=['POST'])
 @requires_auth('post:actors')
 def create_actor(jwt):
     body = request.get_json()
@@ -226,15 +1065,15 @@ def create_actor(jwt):
         )
         actor.insert()
 
-        selection = Actor.query.order_by(Actor.id).all()
-        current_actors = [actor.get_dict()
-                          for actor in paginate(selection, MOVIES_PER_PAGE)]
+        selection = Actor.query.order_by(Actor.id)
+        current_actors = get_serializer(Actor).many(
+            paginate(selection, ACTORS_PER_PAGE))
 
         return jsonify({
             'success': True,
             'created': actor.id,
             'actors': current_actors,
-            'total_actors': len(Actor.query.all())
+            'total_actors': count_rows(Actor)
         })
 
     except Exception as ex:
@@ -243,65 +1082,138 @@ def create_actor(jwt):
         abort(422)
 
 
-@app.route('/actors/<int:actor_id>', methods=['PATCH'])
+@api.route('/actors/bulk', methods=['POST'])
+@requires_auth('post:actors')
+def create_actors(jwt):
+    created, errors = bulk_create(Actor, parse_actor)
+
+    return jsonify({
+        'success': True,
+        'created': created,
+        'errors': errors,
+        'total_actors': count_rows(Actor)
+    })
+
+
+@api.route('/actors/bulk', methods=['PATCH'])
+@requires_auth('patch:actors')
+def update_actors(jwt):
+    condition = get_bulk_condition(Actor, ACTOR_FILTERS)
+    values = get_bulk_values(parse_actor)
+
+    try:
+        updated = Actor.bulk_update(condition, values)
+
+    except Exception as ex:
+        db.session.rollback()
+        print(sys.exc_info())
+        abort(422)
+
+    if updated == 0:
+        abort(404)
+
+    return jsonify({
+        'success': True,
+        'updated': updated
+    })
+
+
+@api.route('/actors/bulk', methods=['DELETE'])
+@requires_auth('delete:actors')
+def delete_actors(jwt):
+    condition = get_bulk_condition(Actor, ACTOR_FILTERS)
+
+    try:
+        deleted = Actor.bulk_delete(condition)
+
+    except Exception as ex:
+        db.session.rollback()
+        print(sys.exc_info())
+        abort(422)
+
+    if deleted == 0:
+        abort(404)
+
+    return jsonify({
+        'success': True,
+        'deleted': deleted
+    })
+
+
+@api.route('/actors/<int:actor_id>', methods=['PATCH'])
 @requires_auth('patch:actors')
 def update_actor(jwt, actor_id):
     body = request.get_json()
 
-    actor = Actor.query.filter(Actor.id == actor_id).one_or_none()
+    try:
+        new_name = body.get('name')
+        new_age = body.get('age')
+        new_gender = body.get('gender')
+
+        # fields left out (or empty) keep their value
+        values = {}
+        if new_name:
+            values['name'] = new_name
+        if new_age:
+            values['age'] = new_age
+        if new_gender:
+            values['gender'] = new_gender
+
+        # one UPDATE ... RETURNING, the row is not read before or after
+        actor = Actor.update_by_id(actor_id, values)
+
+    except Exception as ex:
+        db.session.rollback()
+        print(sys.exc_info())
+        abort(422)
+
     if actor is None:
         return jsonify({
             'success': False,
             'error': 'Actor id ' + str(actor_id) + ' not found to be edited.'
         }), 404
 
-    else:
-        try:
-            new_name = body.get('name')
-            new_age = body.get('age')
-            new_gender = body.get('gender')
-
-            actor.name = new_name or actor.name
-            actor.age = new_age or actor.age
-            actor.gender = new_gender or actor.gender
-
-            actor.update()
-
-            return jsonify({
-                'success': True,
-                'updated_id': actor.id,
-                'updated_actor': actor.get_dict()
-            })
-
-        except Exception as ex:
-            db.session.rollback()
-            print(sys.exc_info())
-            abort(422)
+    return jsonify({
+        'success': True,
+        'updated_id': actor.id,
+        # the serializer only reads attributes, so it takes the row as well
+        'updated_actor': get_serializer(Actor).to_json(actor)
+    })
 
 
-@app.route('/actors/<int:actor_id>', methods=['DELETE'])
+@api.route('/actors/<int:actor_id>', methods=['DELETE'])
 @requires_auth('delete:actors')
 def delete_actor(jwt, actor_id):
-    actor = Actor.query.filter(Actor.id == actor_id).one_or_none()
+    try:
+        # one DELETE ... RETURNING, the row is not read first
+        actor = Actor.delete_by_id(actor_id)
+
+    except Exception as ex:
+        db.session.rollback()
+        print(sys.exc_info())
+        abort(422)
+
     if actor is None:
         return jsonify({
             'success': False,
             'error': 'Actor id ' + str(actor_id) + ' not found to be deleted.'
         }), 404
 
-    else:
-        try:
-            actor.delete()
+    return jsonify({
+        'success': True,
+        'deleted_id': actor_id
+    })
 
-            return jsonify({
-                'success': True,
-                'deleted_id': actor_id
-            })
 
-        except Exception as ex:
-            db.session.rollback()
-            print(sys.exc_info())
-            abort(422)
+@api.route('/admin/pool', methods=['GET'])
+@requires_auth('get:metrics')
+def get_pool_metrics(jwt):
+    return jsonify({
+        'success': True,
+        'pool': pool_status(db.engine.pool),
+        'replicas': current_app.extensions['replica_router'].stats(),
+        'page_cache': page_cache.stats()
+    })
 
 
 '''
@@ -309,7 +1221,7 @@ Error handler
 '''
 
 
-@app.errorhandler(404)
+@api.app_errorhandler(404)
 def not_found(error):
     return jsonify({
         "success": False,
@@ -318,7 +1230,7 @@ def not_found(error):
     }), 404
 
 
-@app.errorhandler(422)
+@api.app_errorhandler(422)
 def unprocessable(error):
     return jsonify({
         "success": False,
@@ -327,7 +1239,7 @@ def unprocessable(error):
     }), 422
 
 
-@app.errorhandler(400)
+@api.app_errorhandler(400)
 def bad_request(error):
     return jsonify({
         "success": False,
@@ -336,7 +1248,7 @@ def bad_request(error):
     }), 400
 
 
-@app.errorhandler(401)
+@api.app_errorhandler(401)
 def unauthorized(error):
     return jsonify({
         "success": False,
@@ -345,7 +1257,7 @@ def unauthorized(error):
     }), 401
 
 
-@app.errorhandler(405)
+@api.app_errorhandler(405)
 def method_not_allowed(error):
     return jsonify({
         "success": False,
@@ -354,7 +1266,7 @@ def method_not_allowed(error):
     }), 405
 
 
-@app.errorhandler(500)
+@api.app_errorhandler(500)
 def internal_server_error(error):
     return jsonify({
         "success": False,
@@ -363,7 +1275,7 @@ def internal_server_error(error):
     }), 500
 
 
-@app.errorhandler(AuthError)
+@api.app_errorhandler(AuthError)
 def process_AuthError(error):
     response = jsonify(error.error)
     response.status_code = error.status_code
@@ -372,4 +1284,5 @@ def process_AuthError(error):
 
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=8080, debug=is_dev)
+    create_app({'JSONIFY_PRETTYPRINT_REGULAR': is_dev}).run(
+        host='0.0.0.0', port=8080, debug=is_dev)
@@ -0,0 +1,174 @@
+'''
+ASGI entry point
+
+    serves the Flask app, with the same routes, error handlers and
+    AuthError handling, from an asyncio event loop:
+        uvicorn asgi:application --host 0.0.0.0 --port 8080
+
+    the loop reads request bodies and writes responses, so a slow client
+    costs a socket and a coroutine instead of a worker. only the view runs
+    in a thread, out of a pool sized to the DB connection pool
+    (ASGI_THREADS), since Flask 1.1 views and SQLAlchemy 1.3 sessions are
+    synchronous. on startup (ASGI lifespan) the JWKS cache and the DB pool
+    are warmed before requests are accepted, so no request waits on the
+    key download; later key refreshes already happen in the background
+    (see auth.JWKSCache).
+'''
+import os
+import sys
+import asyncio
+from tempfile import SpooledTemporaryFile
+from concurrent.futures import ThreadPoolExecutor
+
+from app import app, warm_up
+from pool import DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_PGBOUNCER
+
+
+# threads running views, one per connection the DB pool can hand out
+ASGI_THREADS = int(os.environ.get(
+    'ASGI_THREADS', 32 if DB_PGBOUNCER else DB_POOL_SIZE + DB_MAX_OVERFLOW))
+# request bodies larger than this are spooled to a temporary file
+ASGI_MAX_MEMORY_BODY = int(os.environ.get('ASGI_MAX_MEMORY_BODY',
+                                          1024 * 1024))
+
+
+'''
+WSGIApplication
+ASGI application running a WSGI application in a thread pool
+
+    responses with a Content-Length are built in the thread and sent by the
+    loop. streamed responses (no Content-Length, e.g. the NDJSON exports)
+    are iterated in one thread, which hands every chunk to the loop, so
+    the request context stays on the thread that pushed it.
+'''
+
+
+class WSGIApplication:
+
+    def __init__(self, wsgi_app, threads=ASGI_THREADS, startup=None):
+        self.wsgi_app = wsgi_app
+        self.startup = startup
+        self.executor = ThreadPoolExecutor(max_workers=threads,
+                                           thread_name_prefix='view')
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            raise ValueError(f'Unsupported ASGI scope {scope["type"]}')
+
+        with SpooledTemporaryFile(max_size=ASGI_MAX_MEMORY_BODY) as body:
+            more_body = True
+            while more_body:
+                message = await receive()
+                if message['type'] == 'http.disconnect':
+                    return
+                body.write(message.get('body', b''))
+                more_body = message.get('more_body', False)
+            body.seek(0)
+
+            loop = asyncio.get_running_loop()
+            response = await loop.run_in_executor(
+                self.executor, self.run, build_environ(scope, body),
+                loop, send)
+
+        if response is not None:
+            start, content = response
+            await send(start)
+            await send({'type': 'http.response.body', 'body': content})
+
+    def run(self, environ, loop, send):
+        '''
+        Calls the WSGI app, in a pool thread. returns the start message and
+        body of the response, or None once it has streamed the response
+        '''
+        start = {}
+
+        def start_response(status, headers, exc_info=None):
+            start.update({
+                'type': 'http.response.start',
+                'status': int(status.split(' ', 1)[0]),
+                'headers': [(name.lower().encode('latin1'),
+                             value.encode('latin1'))
+                            for name, value in headers]
+            })
+
+        def send_from_thread(message):
+            asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+        iterable = self.wsgi_app(environ, start_response)
+        try:
+            streamed = not any(name == b'content-length'
+                               for name, _ in start.get('headers', ()))
+            if not streamed:
+                return start, b''.join(iterable)
+
+            started = False
+            for chunk in iterable:
+                if not started:
+                    send_from_thread(start)
+                    started = True
+                if chunk:
+                    send_from_thread({'type': 'http.response.body',
+                                      'body': chunk, 'more_body': True})
+            if not started:
+                send_from_thread(start)
+            send_from_thread({'type': 'http.response.body'})
+            return None
+
+        finally:
+            if hasattr(iterable, 'close'):
+                iterable.close()
+
+    async def lifespan(self, receive, send):
+        loop = asyncio.get_running_loop()
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                if self.startup is not None:
+                    await loop.run_in_executor(self.executor, self.startup)
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.executor.shutdown(wait=True)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+
+def build_environ(scope, body):
+    '''WSGI environ of an ASGI HTTP scope (PEP 3333)'''
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode().decode('latin1'),
+        'PATH_INFO': scope['path'].encode().decode('latin1'),
+        'QUERY_STRING': scope['query_string'].decode('latin1'),
+        'SERVER_PROTOCOL': f'HTTP/{scope["http_version"]}',
+        'SERVER_NAME': 'localhost',
+        'SERVER_PORT': '80',
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': body,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False
+    }
+    if scope.get('server'):
+        environ['SERVER_NAME'] = scope['server'][0]
+        environ['SERVER_PORT'] = str(scope['server'][1])
+    if scope.get('client'):
+        environ['REMOTE_ADDR'] = scope['client'][0]
+
+    for name, value in scope.get('headers', ()):
+        name = name.decode('latin1').upper().replace('-', '_')
+        if name not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            name = f'HTTP_{name}'
+        value = value.decode('latin1')
+        if name in environ:
+            value = f'{environ[name]},{value}'
+        environ[name] = value
+
+    return environ
+
+
+application = WSGIApplication(app, startup=warm_up)
@@ -1,21 +1,58 @@
 import os
 import json
+import time
+import hashlib
+import threading
+import functools
+from collections import OrderedDict
 from flask import request, _request_ctx_stack, abort
 from functools import wraps
-from jose import jwt
 from urllib.request import urlopen
 
 
-# Configurations for Auth0
-AUTH0_DOMAIN = os.environ["AUTH0_DOMAIN"]
-ALGORITHMS = os.environ["ALGORITHMS"]
-API_AUDIENCE = os.environ["API_AUDIENCE"]
-AUTH0_CLIENT_ID = os.environ["AUTH0_CLIENT_ID"]
-AUTH0_CALLBACK_URL = os.environ["AUTH0_CALLBACK_URL"]
+# Configurations for Auth0, required but read from the environment on first
+# use, so importing this module needs neither them nor python-jose, which
+# is imported by the functions verifying tokens
+SETTINGS = ('AUTH0_DOMAIN', 'ALGORITHMS', 'API_AUDIENCE', 'AUTH0_CLIENT_ID',
+            'AUTH0_CALLBACK_URL',
+            # tokens of the tests
+            'CASTING_ASSISTANT_TOKEN', 'EXECUTIVE_PRODUCER_TOKEN',
+            'EXPIRED_TOKEN')
 
-CASTING_ASSISTANT_TOKEN = os.environ["CASTING_ASSISTANT_TOKEN"]
-EXECUTIVE_PRODUCER_TOKEN = os.environ["EXECUTIVE_PRODUCER_TOKEN"]
-EXPIRED_TOKEN = os.environ["EXPIRED_TOKEN"]
+
+def setting(name):
+    return os.environ[name]
+
+
+@functools.lru_cache(maxsize=None)
+def allowed_algorithms():
+    """ALGORITHMS as a list, set as RS256,RS384 or ['RS256']
+    """
+    names = setting('ALGORITHMS').strip().strip('[]').split(',')
+    return [name.strip(' \'"') for name in names if name.strip(' \'"')]
+
+
+def __getattr__(name):
+    """Reads auth.AUTH0_DOMAIN and the other SETTINGS on access (PEP 562)
+    """
+    if name in SETTINGS:
+        return setting(name)
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+
+# JWKS cache, by default https://AUTH0_DOMAIN/.well-known/jwks.json
+JWKS_URL = os.environ.get('JWKS_URL')
+JWKS_CACHE_TTL = int(os.environ.get('JWKS_CACHE_TTL', 600))
+JWKS_MIN_REFRESH_INTERVAL = int(os.environ.get('JWKS_MIN_REFRESH_INTERVAL',
+                                               30))
+JWKS_FETCH_TIMEOUT = int(os.environ.get('JWKS_FETCH_TIMEOUT', 5))
+# offline key sources, used instead of JWKS_URL when set
+JWKS_JSON = os.environ.get('JWKS_JSON')
+JWKS_FILE = os.environ.get('JWKS_FILE')
+
+# Verified token cache
+TOKEN_CACHE_SIZE = int(os.environ.get('TOKEN_CACHE_SIZE', 1024))
+TOKEN_CACHE_TTL = int(os.environ.get('TOKEN_CACHE_TTL', 300))
 
 
 '''
@@ -31,6 +68,228 @@ class AuthError(Exception):
         self.status_code = status_code
 
 
+'''
+JWKSCache
+Process-wide registry of the auth server's public keys (JSON Web Key Set)
+
+    every key in the set is parsed once, when the set is loaded, into a
+    ready-to-use public key object indexed by `kid`.
+    the set is downloaded from `url`, unless a `source` callable returning
+    the JWKS document is given (see load_jwks_file, create_jwks_cache).
+    keys are served from memory for `ttl` seconds. After that the stale set
+    is still served while one background thread fetches a fresh copy, so no
+    request waits on the network once the cache is warm.
+    concurrent refreshes are single-flight: threads that queue up behind a
+    running fetch reuse its result instead of fetching again.
+    a `kid` missing from the cached set forces a synchronous refetch so key
+    rotation is picked up; it is rate limited by `min_refresh_interval` so
+    tokens with made-up key ids cannot hammer the auth server.
+'''
+
+
+class JWKSCache:
+
+    def __init__(self, url=None, ttl=JWKS_CACHE_TTL,
+                 min_refresh_interval=JWKS_MIN_REFRESH_INTERVAL,
+                 timeout=JWKS_FETCH_TIMEOUT, source=None):
+        self.url = url
+        self.source = source or self._download
+        self.ttl = ttl
+        self.min_refresh_interval = min_refresh_interval
+        self.timeout = timeout
+        self.fetch_count = 0
+
+        self._keys = {}
+        self._fetched_at = None
+        self._generation = 0
+        self._lock = threading.Lock()
+        self._background_refresh = None
+
+    def get_key(self, kid):
+        """Returns the public key object for the given key id, or None
+        """
+        if self._fetched_at is None:
+            # cold cache: nothing to serve until the first fetch is done
+            self.refresh()
+        elif self.is_stale():
+            self.refresh_in_background()
+
+        key = self._keys.get(kid)
+        if key is None and self._can_force_refresh():
+            # unknown key id, the key set may have been rotated
+            self.refresh()
+            key = self._keys.get(kid)
+
+        return key
+
+    def is_stale(self):
+        return (self._fetched_at is None or
+                time.monotonic() - self._fetched_at >= self.ttl)
+
+    def refresh(self):
+        """Fetches the key set, sharing the fetch with concurrent callers
+        """
+        generation = self._generation
+        with self._lock:
+            if self._generation != generation:
+                # another thread refreshed while we were waiting
+                return
+
+            jwks = self._fetch()
+            self._set_keys(jwks)
+
+    def refresh_in_background(self):
+        with self._lock:
+            if self._background_refresh is not None:
+                return
+            self._background_refresh = threading.Thread(
+                target=self._run_background_refresh, daemon=True)
+            self._background_refresh.start()
+
+    def clear(self):
+        with self._lock:
+            self._keys = {}
+            self._fetched_at = None
+            self._generation += 1
+
+    def _run_background_refresh(self):
+        try:
+            self.refresh()
+        except Exception as ex:
+            # keep serving the stale keys, the next request retries
+            print('JWKS background refresh failed:', ex)
+        finally:
+            self._background_refresh = None
+
+    def _can_force_refresh(self):
+        return (self._fetched_at is None or
+                time.monotonic() - self._fetched_at >=
+                self.min_refresh_interval)
+
+    def _fetch(self):
+        self.fetch_count += 1
+        return self.source()
+
+    def _download(self):
+        url = self.url or \
+            f'https://{setting("AUTH0_DOMAIN")}/.well-known/jwks.json'
+        jsonurl = urlopen(url, timeout=self.timeout)
+        return json.loads(jsonurl.read())
+
+    def _set_keys(self, jwks):
+        from jose import jwk
+
+        keys = {}
+        for key in jwks['keys']:
+            if key.get('kty') != 'RSA' or key.get('use', 'sig') != 'sig':
+                continue
+            try:
+                keys[key['kid']] = jwk.construct(key, key.get('alg', 'RS256'))
+            except Exception as ex:
+                print('Skipping unusable JWK', key.get('kid'), ex)
+
+        self._keys = keys
+        self._fetched_at = time.monotonic()
+        self._generation += 1
+
+
+def load_jwks_file(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def create_jwks_cache():
+    """Builds the JWKS cache from the configured key source
+
+    JWKS_JSON (inline key set) wins over JWKS_FILE (path to a key set),
+    which wins over downloading JWKS_URL.
+    """
+    if JWKS_JSON:
+        jwks = json.loads(JWKS_JSON)
+        return JWKSCache(source=lambda: jwks)
+
+    if JWKS_FILE:
+        return JWKSCache(source=lambda: load_jwks_file(JWKS_FILE))
+
+    return JWKSCache(JWKS_URL)
+
+
+jwks_cache = create_jwks_cache()
+
+
+'''
+VerifiedTokenCache
+Bounded LRU cache of decoded payloads of tokens that passed verification
+
+    entries are keyed by the SHA-256 digest of the token, so raw tokens are
+    not kept in memory. an entry expires at the token's `exp` claim, or after
+    `ttl` seconds if that comes first, so an expired token is never accepted
+    from the cache. a `maxsize` of 0 disables the cache.
+'''
+
+
+class VerifiedTokenCache:
+
+    def __init__(self, maxsize=TOKEN_CACHE_SIZE, ttl=TOKEN_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+        self._entries = OrderedDict()  # digest -> (expires_at, payload)
+        self._lock = threading.Lock()
+
+    def get(self, token):
+        digest = self._digest(token)
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is None or entry[0] <= time.time():
+                if entry is not None:
+                    del self._entries[digest]
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(digest)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, token, payload):
+        if self.maxsize <= 0:
+            return
+
+        expires_at = time.time() + self.ttl
+        if 'exp' in payload:
+            expires_at = min(expires_at, payload['exp'])
+
+        digest = self._digest(token)
+        with self._lock:
+            self._entries[digest] = (expires_at, payload)
+            self._entries.move_to_end(digest)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self._entries),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0
+        }
+
+    @staticmethod
+    def _digest(token):
+        return hashlib.sha256(token.encode('utf-8')).digest()
+
+
+token_cache = VerifiedTokenCache()
+
+
 # Auth Header
 '''
 @TODO implement get_token_auth_header() method
@@ -111,6 +370,20 @@ def check_permissions(permission, payload):
     return True
 
 
+def verify_signature(token, header, key):
+    """Checks the token signature with a parsed public key object
+    """
+    from jose.exceptions import JWSError
+    from jose.utils import base64url_decode
+
+    if header.get('alg') not in allowed_algorithms():
+        raise JWSError('The specified alg value is not allowed')
+
+    signing_input, crypto_segment = token.encode('utf-8').rsplit(b'.', 1)
+    if not key.verify(signing_input, base64url_decode(crypto_segment)):
+        raise JWSError('Signature verification failed.')
+
+
 '''
 @TODO implement verify_decode_jwt(token) method
     @INPUTS
@@ -118,6 +391,9 @@ def check_permissions(permission, payload):
 
     it should be an Auth0 token with key id (kid)
     it should verify the token using Auth0 /.well-known/jwks.json
+        (served from jwks_cache, see JWKSCache)
+    it should return the cached payload if the token was already verified
+        (see VerifiedTokenCache)
     it should decode the payload from the token
     it should validate the claims
     return the decoded payload
@@ -128,39 +404,39 @@ def check_permissions(permission, payload):
 
 
 def verify_decode_jwt(token):
-    # get the public key of the auth server
-    jsonurl = urlopen(f'https://{AUTH0_DOMAIN}/.well-known/jwks.json')
-    jwks = json.loads(jsonurl.read())
+    # skip the signature check if this token was verified before
+    payload = token_cache.get(token)
+    if payload is not None:
+        return payload
+
+    from jose import jwt
+
     # decode the payload from the token
     unverified_header = jwt.get_unverified_header(token)
 
-    rsa_key = {}
     if 'kid' not in unverified_header:
         raise AuthError({
             'code': 'invalid_header',
             'description': 'Authorization malformed.'
         }, 401)
 
-    # if key id match, then build the RSA key
-    for key in jwks['keys']:
-        if key['kid'] == unverified_header['kid']:
-            rsa_key = {
-                'kty': key['kty'],
-                'kid': key['kid'],
-                'use': key['use'],
-                'n': key['n'],
-                'e': key['e']
-            }
-
-    if rsa_key:
+    # get the parsed public key of the auth server for the key id
+    rsa_key = jwks_cache.get_key(unverified_header['kid'])
+
+    if rsa_key is not None:
         try:
+            # the signature is checked against the parsed key, then jose
+            # validates the claims
+            verify_signature(token, unverified_header, rsa_key)
             payload = jwt.decode(
                 token,
-                rsa_key,
-                algorithms=ALGORITHMS,
-                audience=API_AUDIENCE,
-                issuer='https://' + AUTH0_DOMAIN + '/'
+                '',
+                algorithms=allowed_algorithms(),
+                audience=setting('API_AUDIENCE'),
+                issuer='https://' + setting('AUTH0_DOMAIN') + '/',
+                options={'verify_signature': False}
             )
+            token_cache.set(token, payload)
 
             return payload
 
@@ -0,0 +1,113 @@
+'''
+Benchmarks for the JSON serialisation of API responses
+
+    serialises pages of `--rows` movies and actors (model instances built in
+    memory, no database) into the response body of GET /movies and
+    GET /actors, and reports throughput in bytes per second.
+
+    paths:
+        flask-get_dict: per row dict built field by field with getattr and
+            strftime, then flask.jsonify (stdlib json, sorted keys), the
+            serialisation before serializers.py
+        to_dict/<encoder>: compiled ModelSerializer dicts, then jsonify
+        many/<encoder>: compiled ModelSerializer writing the rows straight
+            to JSON (RawJSON), then jsonify
+
+    usage:
+        source setup.sh
+        python3 bench_json.py [--rows N] [--iterations N]
+'''
+import argparse
+import datetime
+import statistics
+import time
+
+import flask
+from flask import Flask
+
+import serializers
+from serializers import ENCODERS, get_serializer, jsonify, set_encoder
+from models import Movie, Actor
+
+
+bench_app = Flask(__name__)
+
+
+def make_rows(count):
+    movies = []
+    actors = []
+    for i in range(count):
+        movie = Movie(f'Movie "{i}" é', datetime.datetime(1950, 1, 1) +
+                      datetime.timedelta(days=i))
+        movie.id = i + 1
+        movies.append(movie)
+        actor = Actor(f'Actor {i}', 20 + i % 60, 'MF'[i % 2])
+        actor.id = i + 1
+        actors.append(actor)
+
+    return movies, actors
+
+
+def legacy_dict(row, fields):
+    item = {field: getattr(row, field) for field in fields}
+    if 'release_date' in item:
+        item['release_date'] = item['release_date'].strftime("%m/%d/%Y")
+    return item
+
+
+def measure(name, fn, iterations):
+    timings = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        size = len(fn().get_data())
+        timings.append(time.perf_counter() - start)
+
+    mean = statistics.mean(timings)
+    print(f'{name:<28} {size / mean / 1e6:>10,.1f} MB/s'
+          f' {mean * 1e3:>10,.2f} {min(timings) * 1e3:>10,.2f}'
+          f' {size:>12,}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--rows', type=int, default=10000)
+    parser.add_argument('--iterations', type=int, default=20)
+    args = parser.parse_args()
+
+    pages = dict(zip(('movies', 'actors'), make_rows(args.rows)))
+    models = {'movies': Movie, 'actors': Actor}
+
+    print(f'{"benchmark":<28} {"throughput":>15}'
+          f' {"mean ms":>10} {"min ms":>10} {"bytes":>12}')
+
+    with bench_app.app_context():
+        for key, rows in pages.items():
+            model = models[key]
+
+            measure(f'{key} flask-get_dict', lambda: flask.jsonify({
+                'success': True,
+                key: [legacy_dict(row, model.FIELDS) for row in rows],
+                f'total_{key}': len(rows)
+            }), args.iterations)
+
+            for encoder in ENCODERS:
+                set_encoder(encoder)
+                serializer = get_serializer(model)
+
+                measure(f'{key} to_dict/{encoder}', lambda: jsonify({
+                    'success': True,
+                    key: [serializer.to_dict(row) for row in rows],
+                    f'total_{key}': len(rows)
+                }), args.iterations)
+
+                measure(f'{key} many/{encoder}', lambda: jsonify({
+                    'success': True,
+                    key: serializer.many(rows),
+                    f'total_{key}': len(rows)
+                }), args.iterations)
+
+    set_encoder(serializers.JSON_ENCODER)
+
+
+if __name__ == '__main__':
+    main()
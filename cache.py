@@ -0,0 +1,99 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+
+
+PAGE_CACHE_SIZE = int(os.environ.get('PAGE_CACHE_SIZE', 1024))
+PAGE_CACHE_TTL = int(os.environ.get('PAGE_CACHE_TTL', 30))
+PAGE_CACHE_MAX_BYTES = int(os.environ.get('PAGE_CACHE_MAX_BYTES',
+                                          32 * 1024 * 1024))
+
+
+'''
+PageCache
+In-process LRU + TTL cache of serialised page payloads
+
+    keys are (resource, table versions, query parameters). a write, by any
+    process, bumps the version of its table (see models.RowCount), so the
+    entries of the old version are never looked up again and age out of
+    the LRU.
+    the cache is bounded by number of entries and by the total size of the
+    cached bodies (`max_bytes`). a `maxsize` of 0 disables the cache.
+'''
+
+
+class PageCache:
+
+    def __init__(self, maxsize=PAGE_CACHE_SIZE, ttl=PAGE_CACHE_TTL,
+                 max_bytes=PAGE_CACHE_MAX_BYTES):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.size_bytes = 0
+
+        self._entries = OrderedDict()  # key -> (expires_at, body)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(resource, version, args):
+        return (resource, version, tuple(sorted(args.items(multi=True))))
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= time.monotonic():
+                if entry is not None:
+                    self._remove(key)
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, body):
+        if self.maxsize <= 0 or len(body) > self.max_bytes:
+            return
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (time.monotonic() + self.ttl, body)
+            self.size_bytes += len(body)
+
+            while (len(self._entries) > self.maxsize or
+                   self.size_bytes > self.max_bytes):
+                oldest_key = next(iter(self._entries))
+                self._remove(oldest_key)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size_bytes = 0
+
+    def stats(self):
+        '''Counters of the cache, for GET /admin/pool'''
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'maxsize': self.maxsize,
+                'size_bytes': self.size_bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0
+            }
+
+    def _remove(self, key):
+        _, body = self._entries.pop(key)
+        self.size_bytes -= len(body)
+
+
+page_cache = PageCache()
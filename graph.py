@@ -0,0 +1,170 @@
+import os
+import time
+import threading
+from array import array
+from collections import deque
+
+
+CAST_GRAPH_TTL = int(os.environ.get('CAST_GRAPH_TTL', 300))
+
+
+'''
+CastGraph
+In-memory index of the casts table as a bipartite movie/actor graph
+
+    each movie keeps a compact integer array of its actor ids, and each
+    actor one of its movie ids, so "worked with" and collaboration path
+    queries are answered from memory instead of multi-join SQL.
+    the index is built lazily from `loader` (an iterable of
+    (movie_id, actor_id) rows) and kept current by the model write methods
+    of this process. bulk writes drop it to be rebuilt on next use, and it
+    is rebuilt after `ttl` seconds so writes made by other workers show up.
+'''
+
+
+class CastGraph:
+
+    def __init__(self, loader, ttl=CAST_GRAPH_TTL):
+        self.loader = loader
+        self.ttl = ttl
+        self.build_count = 0
+
+        self._movie_actors = None  # movie id -> array of actor ids
+        self._actor_movies = None  # actor id -> array of movie ids
+        self._built_at = None
+        self._lock = threading.RLock()
+
+    def costars(self, actor_id):
+        '''
+        Actors who share at least one movie with the actor, as
+        (actor id, number of shared movies), most shared first
+        '''
+        with self._lock:
+            self._ensure_built()
+            shared = {}
+            for movie_id in self._actor_movies.get(actor_id, ()):
+                for costar_id in self._movie_actors[movie_id]:
+                    if costar_id != actor_id:
+                        shared[costar_id] = shared.get(costar_id, 0) + 1
+
+        return sorted(shared.items(), key=lambda item: (-item[1], item[0]))
+
+    def shortest_path(self, source_id, target_id):
+        '''
+        Shortest collaboration path between two actors, found by BFS
+            returns (actor ids, movie ids) where movie_ids[i] links
+            actor_ids[i] and actor_ids[i + 1], or None if not connected
+        '''
+        with self._lock:
+            self._ensure_built()
+            if source_id not in self._actor_movies or \
+                    target_id not in self._actor_movies:
+                return None
+            if source_id == target_id:
+                return [source_id], []
+
+            # actor id -> (previous actor id, linking movie id)
+            previous = {source_id: None}
+            visited_movies = set()
+            queue = deque([source_id])
+            while queue:
+                actor_id = queue.popleft()
+                for movie_id in self._actor_movies[actor_id]:
+                    if movie_id in visited_movies:
+                        continue
+                    visited_movies.add(movie_id)
+                    for costar_id in self._movie_actors[movie_id]:
+                        if costar_id in previous:
+                            continue
+                        previous[costar_id] = (actor_id, movie_id)
+                        if costar_id == target_id:
+                            return self._unwind(previous, target_id)
+                        queue.append(costar_id)
+
+        return None
+
+    def add_cast(self, movie_id, actor_id):
+        with self._lock:
+            if self._movie_actors is None:
+                return
+            self._movie_actors.setdefault(movie_id, array('i')) \
+                .append(actor_id)
+            self._actor_movies.setdefault(actor_id, array('i')) \
+                .append(movie_id)
+
+    def remove_cast(self, movie_id, actor_id):
+        with self._lock:
+            if self._movie_actors is None:
+                return
+            self._remove_edge(self._movie_actors, movie_id, actor_id)
+            self._remove_edge(self._actor_movies, actor_id, movie_id)
+
+    def remove_movie(self, movie_id):
+        with self._lock:
+            if self._movie_actors is None:
+                return
+            for actor_id in self._movie_actors.pop(movie_id, ()):
+                self._remove_edge(self._actor_movies, actor_id, movie_id)
+
+    def remove_actor(self, actor_id):
+        with self._lock:
+            if self._actor_movies is None:
+                return
+            for movie_id in self._actor_movies.pop(actor_id, ()):
+                self._remove_edge(self._movie_actors, movie_id, actor_id)
+
+    def invalidate(self):
+        with self._lock:
+            self._movie_actors = None
+            self._actor_movies = None
+            self._built_at = None
+
+    def stats(self):
+        with self._lock:
+            if self._movie_actors is None:
+                return {'built': False, 'builds': self.build_count}
+            return {
+                'built': True,
+                'builds': self.build_count,
+                'movies': len(self._movie_actors),
+                'actors': len(self._actor_movies),
+                'casts': sum(map(len, self._movie_actors.values()))
+            }
+
+    def _ensure_built(self):
+        if self._built_at is not None and \
+                time.monotonic() - self._built_at < self.ttl:
+            return
+
+        movie_actors = {}
+        actor_movies = {}
+        for movie_id, actor_id in self.loader():
+            movie_actors.setdefault(movie_id, array('i')).append(actor_id)
+            actor_movies.setdefault(actor_id, array('i')).append(movie_id)
+
+        self._movie_actors = movie_actors
+        self._actor_movies = actor_movies
+        self._built_at = time.monotonic()
+        self.build_count += 1
+
+    @staticmethod
+    def _remove_edge(adjacency, node_id, other_id):
+        neighbours = adjacency.get(node_id)
+        if neighbours is None or other_id not in neighbours:
+            return
+        neighbours.remove(other_id)
+        if len(neighbours) == 0:
+            del adjacency[node_id]
+
+    @staticmethod
+    def _unwind(previous, target_id):
+        actor_ids = [target_id]
+        movie_ids = []
+        while previous[actor_ids[-1]] is not None:
+            actor_id, movie_id = previous[actor_ids[-1]]
+            actor_ids.append(actor_id)
+            movie_ids.append(movie_id)
+
+        actor_ids.reverse()
+        movie_ids.reverse()
+        return actor_ids, movie_ids
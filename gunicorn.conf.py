@@ -0,0 +1,95 @@
+'''
+Gunicorn configuration
+    gunicorn -c gunicorn.conf.py app:app
+
+    the app is imported once, in the master (preload_app), and the workers
+    are forked from it, so they share its code and JWKS key objects instead
+    of each importing and fetching them again. the master warms the JWKS
+    cache and checks the database, then closes its pooled connections
+    before forking: a connection must never be shared by two processes.
+    every worker disposes its inherited engines again after the fork and
+    opens its own DB pool before it accepts requests.
+
+    GUNICORN_WORKER_CLASS: gthread (default), gevent or sync
+    WEB_CONCURRENCY: worker processes, by default
+        sync: 2 * CPUs + 1
+        gthread: CPUs + 1, each running GUNICORN_THREADS threads, by
+            default one per connection of its DB pool
+        gevent: CPUs, each serving GUNICORN_WORKER_CONNECTIONS clients
+'''
+import gc
+import os
+import multiprocessing
+
+from pool import DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_PGBOUNCER
+
+
+GUNICORN_WORKER_CLASS = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+if GUNICORN_WORKER_CLASS not in ('gthread', 'gevent', 'sync'):
+    raise ValueError(f'Unsupported GUNICORN_WORKER_CLASS '
+                     f'{GUNICORN_WORKER_CLASS}, use gthread, gevent or sync')
+
+if GUNICORN_WORKER_CLASS == 'gevent':
+    # patch before the app is preloaded, so the locks and sockets it creates
+    # are gevent aware, and psycopg2 yields to other requests while it waits
+    # for the database
+    from gevent import monkey
+    monkey.patch_all()
+    from psycogreen.gevent import patch_psycopg
+    patch_psycopg()
+
+CPU_COUNT = multiprocessing.cpu_count()
+DEFAULT_WORKERS = {
+    'sync': 2 * CPU_COUNT + 1,
+    'gthread': CPU_COUNT + 1,
+    'gevent': CPU_COUNT
+}
+
+worker_class = GUNICORN_WORKER_CLASS
+workers = int(os.environ.get('WEB_CONCURRENCY',
+                             DEFAULT_WORKERS[GUNICORN_WORKER_CLASS]))
+threads = int(os.environ.get(
+    'GUNICORN_THREADS',
+    8 if DB_PGBOUNCER else DB_POOL_SIZE + DB_MAX_OVERFLOW))
+worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', 1000))
+
+bind = f'0.0.0.0:{os.environ.get("PORT", 8000)}'
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', 5))
+# restart workers now and then, in case of leaks
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 10000))
+max_requests_jitter = max_requests // 10
+
+preload_app = True
+
+
+def when_ready(server):
+    '''
+    Runs in the master, after the app is preloaded and before the workers
+    are forked
+    '''
+    from app import app, warm_up
+    from models import dispose_engines
+
+    warm_up()
+    dispose_engines(app)
+    # the objects of the preloaded app live as long as the master: keep the
+    # collector from touching them, so their pages stay shared with the
+    # workers instead of being copied on write
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    from app import app
+    from models import dispose_engines
+
+    # no-op after when_ready, but makes sure a worker never uses a
+    # connection the master opened
+    dispose_engines(app)
+
+
+def post_worker_init(worker):
+    '''Runs in the worker before it accepts requests'''
+    from app import warm_up
+
+    warm_up()
@@ -0,0 +1,130 @@
+import json
+import time
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import rsa
+from jose import jwt, jwk
+
+from auth import AUTH0_DOMAIN, API_AUDIENCE
+
+
+'''
+LocalIssuer
+Stands in for Auth0 in tests and benchmarks
+
+    generates RSA keypairs locally and mints RS256 tokens with the same
+    audience, issuer and permissions layout that requires_auth expects.
+'''
+
+
+class LocalIssuer:
+
+    def __init__(self, key_size=2048):
+        self.key_size = key_size
+        self.keys = {}  # kid -> (private pem, public jwk)
+        self.published = []  # kids listed in the key set
+        self.current_kid = None
+        self.rotate()
+
+    def rotate(self, publish=True):
+        """Adds a new signing key and makes it the current one
+
+        with publish=False the key signs tokens but stays out of the key set
+        until publish() is called, so it can be generated ahead of time.
+        """
+        kid = f'local-{len(self.keys) + 1}'
+        public_key, private_key = rsa.newkeys(self.key_size)
+        public_jwk = jwk.construct(public_key.save_pkcs1(), 'RS256').to_dict()
+        public_jwk.update({'kid': kid, 'use': 'sig'})
+
+        self.keys[kid] = (private_key.save_pkcs1(), public_jwk)
+        self.current_kid = kid
+        if publish:
+            self.publish(kid)
+        return kid
+
+    def publish(self, kid):
+        self.published.append(kid)
+
+    def retire(self, kid):
+        self.published.remove(kid)
+
+    def jwks(self):
+        return {'keys': [self.keys[kid][1] for kid in self.published]}
+
+    def mint(self, permissions, kid=None, expires_in=3600, **claims):
+        kid = kid or self.current_kid
+        now = int(time.time())
+        payload = {
+            'iss': f'https://{AUTH0_DOMAIN}/',
+            'sub': 'auth0|local',
+            'aud': API_AUDIENCE,
+            'iat': now,
+            'exp': now + expires_in,
+            'scope': '',
+            'permissions': list(permissions)
+        }
+        payload.update(claims)
+        private_pem, _ = self.keys[kid]
+
+        return jwt.encode(payload, private_pem, algorithm='RS256',
+                          headers={'kid': kid})
+
+
+'''
+StubJWKSServer
+Serves an issuer's key set at /.well-known/jwks.json on localhost
+
+    `delay` slows every response down, to make concurrent fetches overlap.
+    `request_count` counts the key set downloads.
+'''
+
+
+class StubJWKSServer:
+
+    def __init__(self, issuer, delay=0):
+        self.issuer = issuer
+        self.delay = delay
+        self.request_count = 0
+
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                stub.request_count += 1
+                if stub.delay:
+                    time.sleep(stub.delay)
+                body = json.dumps(stub.issuer.jwks()).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._thread = threading.Thread(target=self._server.serve_forever,
+                                        daemon=True)
+
+    @property
+    def url(self):
+        host, port = self._server.server_address
+        return f'http://{host}:{port}/.well-known/jwks.json'
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
@@ -0,0 +1,42 @@
+"""indexes for the filters and sort keys of the list endpoints
+
+Revision ID: 2d9e7b5c1f84
+Revises: 8f3b6d2e4a10
+Create Date: 2026-10-18 10:03:17.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '2d9e7b5c1f84'
+down_revision = '8f3b6d2e4a10'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # sort=title, sort=release_date (keyset pages on (key, id))
+    op.create_index('ix_movies_title_id', 'movies', ['title', 'id'])
+    op.create_index('ix_movies_release_date_id', 'movies',
+                    ['release_date', 'id'])
+    # title_prefix, LIKE 'prefix%' whatever the collation
+    op.create_index('ix_movies_title_prefix', 'movies', ['title'],
+                    postgresql_ops={'title': 'text_pattern_ops'})
+
+    # sort=name, sort=age, age_min/age_max
+    op.create_index('ix_actors_name_id', 'actors', ['name', 'id'])
+    op.create_index('ix_actors_age_id', 'actors', ['age', 'id'])
+    # gender, with or without an age range
+    op.create_index('ix_actors_gender_age', 'actors', ['gender', 'age'])
+
+
+def downgrade():
+    op.drop_index('ix_actors_gender_age', table_name='actors')
+    op.drop_index('ix_actors_age_id', table_name='actors')
+    op.drop_index('ix_actors_name_id', table_name='actors')
+
+    op.drop_index('ix_movies_title_prefix', table_name='movies')
+    op.drop_index('ix_movies_release_date_id', table_name='movies')
+    op.drop_index('ix_movies_title_id', table_name='movies')
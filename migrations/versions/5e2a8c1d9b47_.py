@@ -0,0 +1,26 @@
+"""add change version to row_counts for ETags
+
+Revision ID: 5e2a8c1d9b47
+Revises: bd15f9580f3c
+Create Date: 2026-10-18 07:41:27.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5e2a8c1d9b47'
+down_revision = 'bd15f9580f3c'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('row_counts',
+                  sa.Column('version', sa.BigInteger(), nullable=False,
+                            server_default='0'))
+
+
+def downgrade():
+    op.drop_column('row_counts', 'version')
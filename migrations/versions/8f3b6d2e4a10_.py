@@ -0,0 +1,49 @@
+"""full-text and trigram search indexes on movie titles and actor names
+
+Revision ID: 8f3b6d2e4a10
+Revises: 5e2a8c1d9b47
+Create Date: 2026-10-18 09:12:54.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = '8f3b6d2e4a10'
+down_revision = '5e2a8c1d9b47'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+
+    op.add_column('movies', sa.Column(
+        'search_vector', postgresql.TSVECTOR(),
+        sa.Computed("to_tsvector('simple', coalesce(title, ''))")))
+    op.create_index('ix_movies_search_vector', 'movies', ['search_vector'],
+                    postgresql_using='gin')
+    op.create_index('ix_movies_title_trgm', 'movies', ['title'],
+                    postgresql_using='gin',
+                    postgresql_ops={'title': 'gin_trgm_ops'})
+
+    op.add_column('actors', sa.Column(
+        'search_vector', postgresql.TSVECTOR(),
+        sa.Computed("to_tsvector('simple', coalesce(name, ''))")))
+    op.create_index('ix_actors_search_vector', 'actors', ['search_vector'],
+                    postgresql_using='gin')
+    op.create_index('ix_actors_name_trgm', 'actors', ['name'],
+                    postgresql_using='gin',
+                    postgresql_ops={'name': 'gin_trgm_ops'})
+
+
+def downgrade():
+    op.drop_index('ix_actors_name_trgm', table_name='actors')
+    op.drop_index('ix_actors_search_vector', table_name='actors')
+    op.drop_column('actors', 'search_vector')
+
+    op.drop_index('ix_movies_title_trgm', table_name='movies')
+    op.drop_index('ix_movies_search_vector', table_name='movies')
+    op.drop_column('movies', 'search_vector')
@@ -0,0 +1,52 @@
+"""index casts foreign keys, unique (movie_id, actor_id), ON DELETE CASCADE
+
+Revision ID: a61c3e9f2b75
+Revises: 2d9e7b5c1f84
+Create Date: 2026-10-18 10:48:02.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a61c3e9f2b75'
+down_revision = '2d9e7b5c1f84'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # keep the first of duplicated casts, so the pair can be made unique
+    op.execute('DELETE FROM casts duplicate USING casts original '
+               'WHERE duplicate.movie_id = original.movie_id '
+               'AND duplicate.actor_id = original.actor_id '
+               'AND duplicate.id > original.id')
+    op.execute("UPDATE row_counts "
+               "SET row_count = (SELECT count(*) FROM casts), "
+               "version = version + 1 "
+               "WHERE table_name = 'casts'")
+
+    # the unique index also serves lookups by movie_id
+    op.create_unique_constraint('uq_casts_movie_id_actor_id', 'casts',
+                                ['movie_id', 'actor_id'])
+    op.create_index('ix_casts_actor_id', 'casts', ['actor_id'])
+
+    op.drop_constraint('casts_movie_id_fkey', 'casts', type_='foreignkey')
+    op.drop_constraint('casts_actor_id_fkey', 'casts', type_='foreignkey')
+    op.create_foreign_key('casts_movie_id_fkey', 'casts', 'movies',
+                          ['movie_id'], ['id'], ondelete='CASCADE')
+    op.create_foreign_key('casts_actor_id_fkey', 'casts', 'actors',
+                          ['actor_id'], ['id'], ondelete='CASCADE')
+
+
+def downgrade():
+    op.drop_constraint('casts_actor_id_fkey', 'casts', type_='foreignkey')
+    op.drop_constraint('casts_movie_id_fkey', 'casts', type_='foreignkey')
+    op.create_foreign_key('casts_movie_id_fkey', 'casts', 'movies',
+                          ['movie_id'], ['id'])
+    op.create_foreign_key('casts_actor_id_fkey', 'casts', 'actors',
+                          ['actor_id'], ['id'])
+
+    op.drop_index('ix_casts_actor_id', table_name='casts')
+    op.drop_constraint('uq_casts_movie_id_actor_id', 'casts', type_='unique')
@@ -0,0 +1,34 @@
+"""add row_counts table for O(1) totals
+
+Revision ID: bd15f9580f3c
+Revises: dac131d78fda
+Create Date: 2026-10-18 07:20:11.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'bd15f9580f3c'
+down_revision = 'dac131d78fda'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'row_counts',
+        sa.Column('table_name', sa.String(), nullable=False),
+        sa.Column('row_count', sa.BigInteger(), nullable=False),
+        sa.PrimaryKeyConstraint('table_name')
+    )
+    # seed the counters with the current table sizes
+    op.execute("INSERT INTO row_counts (table_name, row_count) "
+               "SELECT 'movies', count(*) FROM movies")
+    op.execute("INSERT INTO row_counts (table_name, row_count) "
+               "SELECT 'actors', count(*) FROM actors")
+
+
+def downgrade():
+    op.drop_table('row_counts')
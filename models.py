@@ -1,25 +1,58 @@
 import os
-from sqlalchemy import Column, String, Integer, DateTime, \
-    ForeignKey, create_engine
+from sqlalchemy import Column, String, Integer, BigInteger, DateTime, \
+    ForeignKey, Computed, DDL, Index, UniqueConstraint, create_engine, \
+    event, func, text, inspect, literal, or_, select
+from sqlalchemy.dialects.postgresql import TSVECTOR, insert as pg_insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import deferred
 from flask_sqlalchemy import SQLAlchemy
 import json
+from graph import CastGraph
+from pool import engine_options
+from replicas import RoutingSQLAlchemy, ReplicaRouter, DATABASE_REPLICA_URLS
+from serializers import get_serializer
 
 
-database_path = os.environ['DATABASE_URL']
-
-db = SQLAlchemy()
+db = RoutingSQLAlchemy()
 
 '''
 setup_db(app)
     binds a flask application and a SQLAlchemy service
+    `database_path` defaults to the DATABASE_URL environment variable. the
+    engine, and with it the database driver, is created on first use.
+    the connection pool is configured from the DB_* environment variables,
+    see pool.engine_options. the reads of GET requests go to the
+    `replica_paths` databases when there are any, see ReplicaRouter.
 '''
 
 
-def setup_db(app, database_path=database_path):
+def setup_db(app, database_path=None, replica_paths=DATABASE_REPLICA_URLS):
+    if database_path is None:
+        database_path = os.environ['DATABASE_URL']
     app.config["SQLALCHEMY_DATABASE_URI"] = database_path
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options(database_path)
+    app.config["SQLALCHEMY_BINDS"] = {
+        f'replica_{i}': replica_path
+        for i, replica_path in enumerate(replica_paths)}
     db.app = app
     db.init_app(app)
+    ReplicaRouter(len(replica_paths)).init_app(app, db)
+
+
+# trigram operators of the search indexes, created by the migrations too
+event.listen(db.Model.metadata, 'before_create',
+             DDL('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+             .execute_if(dialect='postgresql'))
+
+
+def dispose_engines(app):
+    '''
+    Closes the pooled connections of the primary and replica engines, e.g.
+    before forking so no connection is shared between processes
+    '''
+    for bind in [None] + list(app.config["SQLALCHEMY_BINDS"]):
+        db.get_engine(app, bind=bind).dispose()
 
 
 def db_drop_and_create_all():
@@ -27,6 +60,125 @@ def db_drop_and_create_all():
     db.create_all()
 
 
+'''
+RowCount
+Number of rows per table, so totals are read in O(1)
+
+    exact: a counter row per table, moved by ExtendedBaseModelClass
+        insert/delete in the same transaction as the write, so it stays
+        exact across processes. a missing counter is seeded with COUNT(*)
+        on first read, see seed (the migration seeds the existing tables).
+    estimate: the planner's row estimate from pg_class, refreshed by
+        autovacuum/ANALYZE. falls back to exact when not on Postgres or
+        when the table was never analyzed.
+
+    each counter row also holds the table's change `version`, bumped by
+    every write in the same transaction. it is shared by all processes, so
+    it can back ETags and the keys of cached pages.
+'''
+
+
+class RowCount(db.Model):
+    __tablename__ = 'row_counts'
+
+    table_name = Column(String, primary_key=True)
+    row_count = Column(BigInteger, nullable=False)
+    version = Column(BigInteger, nullable=False, default=0,
+                     server_default='0')
+
+    @classmethod
+    def add(cls, model, delta):
+        '''Moves the counter of the model's table, if it is seeded'''
+        db.session.query(cls) \
+            .filter(cls.table_name == model.__tablename__) \
+            .update({cls.row_count: cls.row_count + delta,
+                     cls.version: cls.version + 1},
+                    synchronize_session=False)
+
+    @classmethod
+    def touch(cls, model):
+        '''Bumps the version of the model's table, for updates'''
+        db.session.query(cls) \
+            .filter(cls.table_name == model.__tablename__) \
+            .update({cls.version: cls.version + 1},
+                    synchronize_session=False)
+
+    @classmethod
+    def get_versions(cls, models):
+        '''
+        Change versions of the models' tables, in one query
+            a missing counter is seeded, and its version reported as 0.
+        '''
+        table_names = [model.__tablename__ for model in models]
+        versions = dict(db.session.query(cls.table_name, cls.version)
+                        .filter(cls.table_name.in_(table_names)))
+        for model in models:
+            if model.__tablename__ not in versions:
+                cls.exact(model)
+                versions[model.__tablename__] = 0
+
+        return [versions[table_name] for table_name in table_names]
+
+    @classmethod
+    def exact(cls, model):
+        row_count = db.session.query(cls.row_count) \
+            .filter(cls.table_name == model.__tablename__).scalar()
+        if row_count is not None:
+            return row_count
+
+        return cls.seed(model)
+
+    @classmethod
+    def seed(cls, model):
+        '''
+        Seeds the counter of the model's table with COUNT(*), on the primary
+            on Postgres the table is locked against writes (SHARE mode) from
+            the count to the commit, so no insert or delete slips between
+            them, and a concurrent seeder's ON CONFLICT DO NOTHING keeps the
+            first counter. the counter is read again after the commit.
+        '''
+        table = cls.__table__
+        values = {'table_name': model.__tablename__}
+        try:
+            if db.engine.dialect.name == 'postgresql':
+                table_name = db.engine.dialect.identifier_preparer \
+                    .format_table(model.__table__)
+                db.session.execute(
+                    text(f'LOCK TABLE {table_name} IN SHARE MODE'),
+                    bind=db.engine)
+                statement = pg_insert(table).on_conflict_do_nothing()
+            else:
+                statement = table.insert()
+            values['row_count'] = db.session.execute(
+                select([func.count()]).select_from(model.__table__),
+                bind=db.engine).scalar()
+            db.session.execute(statement.values(values), bind=db.engine)
+            db.session.commit()
+
+        except IntegrityError:
+            # another process seeded it first
+            db.session.rollback()
+
+        return db.session.execute(
+            select([table.c.row_count])
+            .where(table.c.table_name == model.__tablename__),
+            bind=db.engine).scalar()
+
+    @classmethod
+    def estimate(cls, model):
+        if db.session.get_bind().dialect.name != 'postgresql':
+            return cls.exact(model)
+
+        row_count = db.session.execute(
+            text('SELECT reltuples::bigint FROM pg_class '
+                 'WHERE oid = to_regclass(:table_name)'),
+            {'table_name': model.__tablename__}).scalar()
+        if row_count is None or row_count < 0:
+            return cls.exact(model)
+
+        return row_count
+
+
 '''
 Extend the base Model class to add common methods
 '''
@@ -37,14 +189,175 @@ class ExtendedBaseModelClass(db.Model):
 
     def insert(self):
         db.session.add(self)
+        RowCount.add(type(self), 1)
         db.session.commit()
 
     def update(self):
+        RowCount.touch(type(self))
         db.session.commit()
 
     def delete(self):
+        cascades = self.delete_cascades()
+        for relationship in cascades:
+            # the database cascade deletes the children with the row,
+            # counted inside the counter UPDATE so they are never loaded
+            RowCount.add(relationship.mapper.class_,
+                         -self.count_children(relationship, [self.id]))
         db.session.delete(self)
+        RowCount.add(type(self), -1)
+        db.session.commit()
+
+    @classmethod
+    def update_by_id(cls, id, values):
+        '''
+        UPDATE ... WHERE id RETURNING the FIELDS of the row
+            one round trip instead of loading the object, flushing it and
+            reloading it after the commit expired it. returns the updated
+            row, or None (and writes nothing) if there is no such row.
+            without values the row is only read, from the primary: it may
+            have just been written and not be on the read replicas yet.
+        '''
+        table = cls.__table__
+        columns = [table.c[field] for field in cls.FIELDS]
+        if not values:
+            return db.session.execute(
+                select(columns).where(table.c.id == id),
+                bind=db.engine).first()
+
+        row = db.session.execute(
+            table.update().where(table.c.id == id).values(values)
+            .returning(*columns)).first()
+        if row is None:
+            db.session.rollback()
+            return None
+
+        RowCount.touch(cls)
+        db.session.commit()
+        return row
+
+    @classmethod
+    def delete_by_id(cls, id):
+        '''
+        DELETE ... WHERE id RETURNING the FIELDS of the row
+            the row is not loaded first, see update_by_id. returns the
+            deleted row, or None (and writes nothing) if there is no such
+            row. children are deleted by the database, as in delete().
+        '''
+        table = cls.__table__
+        cascades = cls.delete_cascades()
+        for relationship in cascades:
+            RowCount.add(relationship.mapper.class_,
+                         -cls.count_children(relationship, [id]))
+        row = db.session.execute(
+            table.delete().where(table.c.id == id)
+            .returning(*[table.c[field] for field in cls.FIELDS])).first()
+        if row is None:
+            db.session.rollback()
+            return None
+
+        RowCount.add(cls, -1)
+        db.session.commit()
+        return row
+
+    @classmethod
+    def delete_cascades(cls):
+        '''Relationships whose rows are deleted with the row (Movie.casts)'''
+        return [relationship
+                for relationship in inspect(cls).relationships
+                if relationship.cascade.delete]
+
+    @staticmethod
+    def count_children(relationship, ids):
+        '''
+        Scalar subquery counting the rows of `relationship` whose parent id
+        is in `ids` (a list or a subquery of ids)
+        '''
+        child = relationship.mapper.class_
+        column, = relationship.remote_side
+        return db.session.query(func.count(child.id)) \
+            .filter(column.in_(ids)).as_scalar()
+
+    @classmethod
+    def bulk_insert(cls, rows):
+        '''Inserts row mappings with one executemany, in one transaction'''
+        db.session.bulk_insert_mappings(cls, rows)
+        RowCount.add(cls, len(rows))
         db.session.commit()
+        if cls is Cast:
+            # rows came in without passing through the graph hooks
+            cast_graph.invalidate()
+
+    @classmethod
+    def bulk_update(cls, condition, values):
+        '''UPDATE ... WHERE condition, returns the number of updated rows'''
+        updated = db.session.query(cls).filter(condition) \
+            .update(values, synchronize_session=False)
+        RowCount.touch(cls)
+        db.session.commit()
+        if cls is Cast:
+            # edges may have moved without passing through the graph hooks
+            cast_graph.invalidate()
+        return updated
+
+    @classmethod
+    def bulk_delete(cls, condition):
+        '''
+        DELETE ... WHERE condition, returns the number of deleted rows
+            the rows of relationships with a delete cascade (Movie.casts,
+            Actor.casts) are deleted by the database (ON DELETE CASCADE),
+            their counters are moved first, all in one transaction.
+        '''
+        ids = db.session.query(cls.id).filter(condition).subquery()
+        cascades = cls.delete_cascades()
+        for relationship in cascades:
+            RowCount.add(relationship.mapper.class_,
+                         -cls.count_children(relationship, ids))
+
+        deleted = db.session.query(cls).filter(condition) \
+            .delete(synchronize_session=False)
+        RowCount.add(cls, -deleted)
+        db.session.commit()
+
+        if cls is Cast or cascades:
+            # rows went away without passing through the graph hooks
+            cast_graph.invalidate()
+        return deleted
+
+    @classmethod
+    def count(cls, estimate=False):
+        '''Total number of rows, see RowCount'''
+        if estimate:
+            return RowCount.estimate(cls)
+        return RowCount.exact(cls)
+
+    # column matched by search(), indexed in search_vector (Movie.title)
+    SEARCH_COLUMN = None
+
+    @classmethod
+    def search(cls, text_query):
+        '''
+        Query of the rows matching `text_query`, best match first
+            on Postgres a row matches on the full-text search_vector (GIN
+            index) or on trigram word similarity of SEARCH_COLUMN (GIN
+            trigram index), so misspelt words still match. both predicates
+            are answered from their index and ranked by the better of the
+            two scores. other databases fall back to a case-insensitive
+            substring match.
+        '''
+        column = getattr(cls, cls.SEARCH_COLUMN)
+        if db.session.get_bind().dialect.name != 'postgresql':
+            return cls.query \
+                .filter(func.lower(column).contains(text_query.lower(),
+                                                    autoescape=True)) \
+                .order_by(column, cls.id)
+
+        ts_query = func.plainto_tsquery('simple', text_query)
+        rank = func.greatest(func.ts_rank(cls.search_vector, ts_query),
+                             func.word_similarity(text_query, column))
+        return cls.query \
+            .filter(or_(cls.search_vector.op('@@')(ts_query),
+                        literal(text_query).op('<%')(column))) \
+            .order_by(rank.desc(), cls.id)
 
 
 '''
@@ -55,12 +368,28 @@ Have title and release date
 
 class Movie(ExtendedBaseModelClass):
     __tablename__ = 'movies'
+    __table_args__ = (
+        Index('ix_movies_search_vector', 'search_vector',
+              postgresql_using='gin'),
+        Index('ix_movies_title_trgm', 'title', postgresql_using='gin',
+              postgresql_ops={'title': 'gin_trgm_ops'}),
+        # sort keys and filters of GET /movies
+        Index('ix_movies_title_id', 'title', 'id'),
+        Index('ix_movies_release_date_id', 'release_date', 'id'),
+        Index('ix_movies_title_prefix', 'title',
+              postgresql_ops={'title': 'text_pattern_ops'}),
+    )
 
     id = Column(Integer, primary_key=True)
     title = Column(String)
     release_date = Column(DateTime)
+    # generated by Postgres from title, see ExtendedBaseModelClass.search
+    search_vector = deferred(Column(
+        TSVECTOR, Computed("to_tsvector('simple', coalesce(title, ''))")))
+    # casts are deleted by the database, ON DELETE CASCADE
     casts = db.relationship('Cast', backref=db.backref('movie', lazy=True),
-                            cascade="all, delete-orphan")
+                            cascade="all, delete-orphan",
+                            passive_deletes=True)
 
     def __init__(self, title, release_date):
         self.title = title
@@ -69,12 +398,24 @@ class Movie(ExtendedBaseModelClass):
     def __repr__(self):
         return '<Movie %r>' % self
 
-    def get_dict(self):
-        return {
-            'id': self.id,
-            'title': self.title,
-            'release_date': self.release_date.strftime("%m/%d/%Y")
-        }
+    def delete(self):
+        movie_id = self.id
+        super().delete()
+        cast_graph.remove_movie(movie_id)
+
+    @classmethod
+    def delete_by_id(cls, movie_id):
+        row = super().delete_by_id(movie_id)
+        if row is not None:
+            cast_graph.remove_movie(movie_id)
+        return row
+
+    # fields of get_dict, a subset can be requested (sparse fieldsets)
+    FIELDS = ('id', 'title', 'release_date')
+    SEARCH_COLUMN = 'title'
+
+    def get_dict(self, fields=FIELDS):
+        return get_serializer(Movie, fields).to_dict(self)
 
 
 '''
@@ -85,13 +426,28 @@ Have name, age, and gender
 
 class Actor(ExtendedBaseModelClass):
     __tablename__ = 'actors'
+    __table_args__ = (
+        Index('ix_actors_search_vector', 'search_vector',
+              postgresql_using='gin'),
+        Index('ix_actors_name_trgm', 'name', postgresql_using='gin',
+              postgresql_ops={'name': 'gin_trgm_ops'}),
+        # sort keys and filters of GET /actors
+        Index('ix_actors_name_id', 'name', 'id'),
+        Index('ix_actors_age_id', 'age', 'id'),
+        Index('ix_actors_gender_age', 'gender', 'age'),
+    )
 
     id = Column(Integer, primary_key=True)
     name = Column(String)
     age = Column(Integer)
     gender = Column(String)
+    # generated by Postgres from name, see ExtendedBaseModelClass.search
+    search_vector = deferred(Column(
+        TSVECTOR, Computed("to_tsvector('simple', coalesce(name, ''))")))
+    # casts are deleted by the database, ON DELETE CASCADE
     casts = db.relationship('Cast', backref=db.backref('actor', lazy=True),
-                            cascade="all, delete-orphan")
+                            cascade="all, delete-orphan",
+                            passive_deletes=True)
 
     def __init__(self, name, age, gender):
         self.name = name
@@ -101,23 +457,41 @@ class Actor(ExtendedBaseModelClass):
     def __repr__(self):
         return '<Actor %r>' % self
 
-    def get_dict(self):
-        return {
-            'id': self.id,
-            'name': self.name,
-            'age': self.age,
-            'gender': self.gender
-        }
+    def delete(self):
+        actor_id = self.id
+        super().delete()
+        cast_graph.remove_actor(actor_id)
+
+    @classmethod
+    def delete_by_id(cls, actor_id):
+        row = super().delete_by_id(actor_id)
+        if row is not None:
+            cast_graph.remove_actor(actor_id)
+        return row
+
+    # fields of get_dict, a subset can be requested (sparse fieldsets)
+    FIELDS = ('id', 'name', 'age', 'gender')
+    SEARCH_COLUMN = 'name'
+
+    def get_dict(self, fields=FIELDS):
+        return get_serializer(Actor, fields).to_dict(self)
 
 
 class Cast(ExtendedBaseModelClass):
     '''Join table (Associated/Intermediary table) between Movie and Actor'''
 
     __tablename__ = 'casts'
+    # the unique index also serves lookups by movie_id
+    __table_args__ = (
+        UniqueConstraint('movie_id', 'actor_id',
+                         name='uq_casts_movie_id_actor_id'),
+    )
 
     id = db.Column(Integer, primary_key=True)
-    movie_id = db.Column(Integer, ForeignKey(Movie.id), nullable=False)
-    actor_id = db.Column(Integer, ForeignKey(Actor.id), nullable=False)
+    movie_id = db.Column(Integer, ForeignKey(Movie.id, ondelete='CASCADE'),
+                         nullable=False)
+    actor_id = db.Column(Integer, ForeignKey(Actor.id, ondelete='CASCADE'),
+                         nullable=False, index=True)
 
     def __init__(self, movie_id, actor_id):
         self.movie_id = movie_id
@@ -126,9 +500,29 @@ class Cast(ExtendedBaseModelClass):
     def __repr__(self):
         return '<Cast %r>' % self
 
+    def insert(self):
+        super().insert()
+        cast_graph.add_cast(self.movie_id, self.actor_id)
+
+    def update(self):
+        super().update()
+        cast_graph.invalidate()
+
+    def delete(self):
+        movie_id, actor_id = self.movie_id, self.actor_id
+        super().delete()
+        cast_graph.remove_cast(movie_id, actor_id)
+
+    FIELDS = ('id', 'movie_id', 'actor_id')
+
     def get_dict(self):
-        return {
-            'id': self.id,
-            'movie_id': self.movie_id,
-            'actor_id': self.actor_id,
-        }
+        return get_serializer(Cast).to_dict(self)
+
+
+'''
+cast_graph
+Co-star graph of this process, see CastGraph
+'''
+
+cast_graph = CastGraph(
+    lambda: db.session.query(Cast.movie_id, Cast.actor_id).yield_per(10000))
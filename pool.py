@@ -0,0 +1,153 @@
+import os
+import time
+import bisect
+import threading
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.pool import QueuePool, NullPool
+
+
+def env_flag(name, default):
+    return os.environ.get(name, default).lower() in ('1', 'true', 'yes')
+
+
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 5))
+DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', 10))
+# seconds to wait for a connection before giving up
+DB_POOL_TIMEOUT = int(os.environ.get('DB_POOL_TIMEOUT', 30))
+# seconds after which a connection is replaced, below server/LB idle limits
+DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', 1800))
+DB_POOL_PRE_PING = env_flag('DB_POOL_PRE_PING', 'true')
+# milliseconds, 0 disables
+DB_STATEMENT_TIMEOUT = int(os.environ.get('DB_STATEMENT_TIMEOUT', 30000))
+# connect through PgBouncer in transaction pooling mode
+DB_PGBOUNCER = env_flag('DB_PGBOUNCER', 'false')
+
+
+'''
+WaitHistogram
+Histogram of the time requests wait for a pooled connection
+
+    `buckets` are upper bounds in seconds. counts are reported cumulative,
+    Prometheus style: the count of a bucket includes every faster wait.
+'''
+
+
+class WaitHistogram:
+
+    BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30)
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self.clear()
+
+    def observe(self, seconds):
+        with self._lock:
+            self._counts[bisect.bisect_left(self.buckets, seconds)] += 1
+            self.count += 1
+            self.sum += seconds
+            self.max = max(self.max, seconds)
+
+    def clear(self):
+        with self._lock:
+            # one count per bucket, plus the waits above the last bucket
+            self._counts = [0] * (len(self.buckets) + 1)
+            self.count = 0
+            self.sum = 0.0
+            self.max = 0.0
+
+    def stats(self):
+        with self._lock:
+            cumulative = 0
+            buckets = []
+            for bound, count in zip(self.buckets + ('+Inf',), self._counts):
+                cumulative += count
+                buckets.append({'le': bound, 'count': cumulative})
+
+            return {
+                'buckets': buckets,
+                'count': self.count,
+                'sum': self.sum,
+                'max': self.max,
+                'mean': self.sum / self.count if self.count else 0.0
+            }
+
+
+# waits of the pools of this process, kept across engine.dispose()
+pool_wait_histogram = WaitHistogram()
+
+
+'''
+TimedQueuePool / TimedNullPool
+SQLAlchemy pools recording every checkout wait in pool_wait_histogram
+
+    the wait covers queueing for a free connection and, when the pool
+    opens one, connecting.
+'''
+
+
+class TimedPoolMixin:
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            pool_wait_histogram.observe(time.perf_counter() - start)
+
+
+class TimedQueuePool(TimedPoolMixin, QueuePool):
+    pass
+
+
+class TimedNullPool(TimedPoolMixin, NullPool):
+    pass
+
+
+def engine_options(database_path, pgbouncer=DB_PGBOUNCER):
+    '''
+    SQLALCHEMY_ENGINE_OPTIONS from the DB_* environment variables
+        pgbouncer: PgBouncer does the pooling, so connections are not kept
+        here (NullPool), and no startup `options` are sent, which PgBouncer
+        rejects. set statement_timeout on the database role instead.
+    '''
+    options = {'pool_pre_ping': DB_POOL_PRE_PING}
+    if pgbouncer:
+        options['poolclass'] = TimedNullPool
+        return options
+
+    options.update({
+        'poolclass': TimedQueuePool,
+        'pool_size': DB_POOL_SIZE,
+        'max_overflow': DB_MAX_OVERFLOW,
+        'pool_timeout': DB_POOL_TIMEOUT,
+        'pool_recycle': DB_POOL_RECYCLE
+    })
+    drivername = make_url(database_path).drivername
+    if drivername.startswith('postgres') and DB_STATEMENT_TIMEOUT > 0:
+        options['connect_args'] = {
+            'options': f'-c statement_timeout={DB_STATEMENT_TIMEOUT}'
+        }
+    elif drivername.startswith('sqlite'):
+        # pooled connections are handed to whichever thread checks them out
+        options['connect_args'] = {'check_same_thread': False}
+
+    return options
+
+
+def pool_status(pool):
+    '''Connection counts of `pool` and the checkout wait histogram'''
+    status = {'class': type(pool).__name__}
+    if isinstance(pool, QueuePool):
+        status.update({
+            'size': pool.size(),
+            'checked_out': pool.checkedout(),
+            'idle': pool.checkedin(),
+            # overflow() counts from -size, extra connections are above 0
+            'overflow': max(pool.overflow(), 0),
+            'max_overflow': pool._max_overflow,
+            'timeout': pool.timeout()
+        })
+    status['wait_seconds'] = pool_wait_histogram.stats()
+
+    return status
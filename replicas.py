@@ -0,0 +1,239 @@
+import os
+import time
+import threading
+from flask import current_app, g, request, has_app_context
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
+from sqlalchemy import orm, text
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.sql.dml import UpdateBase
+
+
+# comma separated URLs of read replicas of DATABASE_URL, none by default
+DATABASE_REPLICA_URLS = [url.strip() for url in
+                         os.environ.get('DATABASE_REPLICA_URLS', '').split(',')
+                         if url.strip()]
+# seconds a client reads from the primary after one of its writes
+REPLICA_READ_YOUR_WRITES = float(os.environ.get('REPLICA_READ_YOUR_WRITES', 5))
+# seconds of replication lag above which a replica is skipped
+REPLICA_MAX_LAG = float(os.environ.get('REPLICA_MAX_LAG', 10))
+# seconds between two lag/health checks of a replica
+REPLICA_CHECK_INTERVAL = float(os.environ.get('REPLICA_CHECK_INTERVAL', 5))
+# seconds a replica that failed is skipped
+REPLICA_RETRY_AFTER = float(os.environ.get('REPLICA_RETRY_AFTER', 30))
+# cookie holding the time of the client's last write, see ReplicaRouter
+REPLICA_WRITE_COOKIE = os.environ.get('REPLICA_WRITE_COOKIE', 'db_written_at')
+
+# replay lag of a Postgres standby, 0 when it has replayed all it received
+REPLICA_LAG_SQL = text(
+    'SELECT CASE WHEN NOT pg_is_in_recovery() '
+    'OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 '
+    'ELSE extract(epoch FROM now() - pg_last_xact_replay_timestamp()) END')
+
+READ_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+'''
+ReplicaRouter
+Sends the database reads of GET requests to read replicas
+
+    replicas are Flask-SQLAlchemy binds ("replica_0", ...). before a GET
+    request a replica is picked round robin among the healthy ones, and the
+    session reads through it (see RoutingSession). writes always go to the
+    primary. the primary also serves the reads of
+        - clients that wrote less than `read_your_writes` seconds ago. a
+          successful write sets the REPLICA_WRITE_COOKIE cookie to its
+          time, so the client is routed on it by any worker or instance.
+        - requests that find no replica whose last check was successful and
+          showed less than `max_lag` seconds of lag. a replica is checked
+          at most every `check_interval` seconds, and one that fails a
+          check or a connection is skipped for `retry_after` seconds.
+    the last write of the process is kept too: until a replica can no
+    longer be behind it (`may_lag`), pages read from a replica are neither
+    cached nor given an ETag (see app.cached_page, app.conditional_get).
+'''
+
+
+class ReplicaRouter:
+
+    def __init__(self, replica_count,
+                 read_your_writes=REPLICA_READ_YOUR_WRITES,
+                 max_lag=REPLICA_MAX_LAG,
+                 check_interval=REPLICA_CHECK_INTERVAL,
+                 retry_after=REPLICA_RETRY_AFTER):
+        self.bind_keys = [f'replica_{i}' for i in range(replica_count)]
+        self.read_your_writes = read_your_writes
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self.retry_after = retry_after
+        self.replica_reads = 0
+        self.primary_reads = 0
+
+        # bind key -> (checked at, lag or None if the check failed)
+        self._checks = {}
+        self._down_until = {}  # bind key -> time it is tried again
+        self._written_at = float('-inf')  # last write of the process
+        self._next = 0
+        self._lock = threading.Lock()
+
+    def init_app(self, app, db):
+        self.app = app
+        self.db = db
+        if 'replica_router' not in app.extensions:
+            app.before_request(route_request)
+            app.after_request(record_request)
+        app.extensions['replica_router'] = self
+
+    def route_request(self):
+        '''Picks the bind of the request's reads, None for the primary'''
+        g.db_replica = None
+        if request.method not in READ_METHODS or not self.bind_keys:
+            return
+        if self.wrote_recently():
+            self.primary_reads += 1
+            return
+
+        g.db_replica = self.choose()
+        if g.db_replica is None:
+            self.primary_reads += 1
+        else:
+            self.replica_reads += 1
+
+    def record_request(self, response):
+        if request.method in READ_METHODS or response.status_code >= 400 or \
+                not self.bind_keys:
+            return response
+
+        self._written_at = time.monotonic()
+        response.set_cookie(REPLICA_WRITE_COOKIE, '%.3f' % time.time(),
+                            max_age=max(1, round(self.read_your_writes)),
+                            secure=request.is_secure, httponly=True,
+                            samesite='Lax')
+        return response
+
+    def wrote_recently(self):
+        '''Whether the client's write cookie is within read_your_writes'''
+        try:
+            written_at = float(request.cookies[REPLICA_WRITE_COOKIE])
+        except (KeyError, ValueError):
+            return False
+        # a time in the future is a forged cookie or a skewed clock
+        age = time.time() - written_at
+        return -self.read_your_writes < age < self.read_your_writes
+
+    def may_lag(self):
+        '''Whether the request's replica may miss the process's last write'''
+        return g.get('db_replica') is not None and \
+            time.monotonic() - self._written_at < \
+            self.max_lag + self.check_interval
+
+    def choose(self):
+        for _ in range(len(self.bind_keys)):
+            with self._lock:
+                bind_key = self.bind_keys[self._next % len(self.bind_keys)]
+                self._next += 1
+            if self.is_usable(bind_key):
+                return bind_key
+
+        return None
+
+    def is_usable(self, bind_key):
+        now = time.monotonic()
+        if self._down_until.get(bind_key, 0) > now:
+            return False
+
+        checked_at, lag = self._checks.get(bind_key, (None, None))
+        if checked_at is None or now - checked_at >= self.check_interval:
+            lag = self.check(bind_key)
+        return lag is not None and lag <= self.max_lag
+
+    def check(self, bind_key):
+        '''Measures the replication lag of the replica, None if it failed'''
+        engine = self.db.get_engine(self.app, bind=bind_key)
+        try:
+            with engine.connect() as connection:
+                if engine.dialect.name == 'postgresql':
+                    lag = float(connection.execute(REPLICA_LAG_SQL).scalar())
+                else:
+                    connection.execute(text('SELECT 1'))
+                    lag = 0.0
+        except DBAPIError:
+            lag = None
+
+        self._checks[bind_key] = (time.monotonic(), lag)
+        if lag is None:
+            self.mark_down(bind_key)
+        return lag
+
+    def mark_down(self, bind_key):
+        self._down_until[bind_key] = time.monotonic() + self.retry_after
+
+    def stats(self):
+        now = time.monotonic()
+        return {
+            'replicas': {
+                bind_key: {
+                    'lag': self._checks.get(bind_key, (None, None))[1],
+                    'down': self._down_until.get(bind_key, 0) > now
+                } for bind_key in self.bind_keys},
+            'replica_reads': self.replica_reads,
+            'primary_reads': self.primary_reads
+        }
+
+
+def route_request():
+    current_app.extensions['replica_router'].route_request()
+
+
+def record_request(response):
+    return current_app.extensions['replica_router'].record_request(response)
+
+
+def replica_may_lag():
+    return current_app.extensions['replica_router'].may_lag()
+
+
+'''
+RoutingSession
+Session reading through the replica picked for the request
+
+    flushes and UPDATE/DELETE/INSERT statements always go to the primary.
+    a replica that cannot be connected to is marked down and the request
+    falls back to the primary.
+'''
+
+
+class RoutingSession(SignallingSession):
+
+    def __init__(self, db, **options):
+        self.db = db
+        super().__init__(db, **options)
+
+    def get_bind(self, mapper=None, clause=None):
+        bind_key = g.get('db_replica') if has_app_context() else None
+        if bind_key is None or self._flushing or \
+                isinstance(clause, UpdateBase):
+            return super().get_bind(mapper, clause)
+
+        return self.db.get_engine(self.app, bind=bind_key)
+
+    def _connection_for_bind(self, engine, execution_options=None, **kw):
+        try:
+            return super()._connection_for_bind(engine, execution_options,
+                                                **kw)
+        except DBAPIError:
+            bind_key = g.get('db_replica') if has_app_context() else None
+            if bind_key is None or \
+                    engine is not self.db.get_engine(self.app, bind=bind_key):
+                raise
+
+            print('replica', bind_key, 'is down, reading from the primary')
+            self.app.extensions['replica_router'].mark_down(bind_key)
+            g.db_replica = None
+            return super()._connection_for_bind(
+                self.db.get_engine(self.app), execution_options, **kw)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
@@ -0,0 +1,241 @@
+import os
+import json
+import datetime
+from json.encoder import encode_basestring
+from flask import current_app
+from sqlalchemy import DateTime, Integer
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+# JSON library of the responses: orjson (default when installed) or stdlib
+JSON_ENCODER = os.environ.get('JSON_ENCODER',
+                              'orjson' if orjson is not None else 'stdlib')
+# indented responses, for development. off unless set, also in debug mode
+JSON_PRETTYPRINT = os.environ.get('JSON_PRETTYPRINT', 'false').lower() in \
+    ('1', 'true', 'yes')
+
+
+def encode_default(obj):
+    '''Types the stdlib json module does not handle'''
+    if isinstance(obj, (datetime.datetime, datetime.date)):
+        return obj.isoformat()
+    raise TypeError(f'Object of type {type(obj).__name__} '
+                    f'is not JSON serializable')
+
+
+def stdlib_dumps(obj, indent=None):
+    separators = (',', ':') if indent is None else None
+    return json.dumps(obj, ensure_ascii=False, separators=separators,
+                      indent=indent, default=encode_default).encode()
+
+
+def stdlib_encode_value(value):
+    # the C string encoder of json.dumps, without its per call setup
+    if isinstance(value, str):
+        return encode_basestring(value).encode()
+    return stdlib_dumps(value)
+
+
+def orjson_dumps(obj, indent=None):
+    # datetimes are serialised natively, as RFC 3339
+    return orjson.dumps(obj, option=orjson.OPT_INDENT_2 if indent else 0)
+
+
+# name -> dumps(obj, indent=None) returning UTF-8 bytes, see set_encoder
+ENCODERS = {'stdlib': stdlib_dumps}
+if orjson is not None:
+    ENCODERS['orjson'] = orjson_dumps
+# name -> encoder of a single field value, for libraries whose dumps is
+# slower than writing the rows field by field (see ModelSerializer.many)
+VALUE_ENCODERS = {'stdlib': stdlib_encode_value}
+
+dumps = None
+encode_value = None
+
+
+def set_encoder(name):
+    '''Selects the JSON library by its ENCODERS name'''
+    global dumps, encode_value
+    if name not in ENCODERS:
+        raise ValueError(f'Unknown JSON encoder {name}, '
+                         f'use one of {", ".join(ENCODERS)}')
+    dumps = ENCODERS[name]
+    encode_value = VALUE_ENCODERS.get(name)
+    # the compiled serializers bind the encoder
+    _serializers.clear()
+
+
+def loads(data):
+    return orjson.loads(data) if orjson is not None else json.loads(data)
+
+
+'''
+RawJSON
+Encoded JSON, embedded as is by jsonify
+    e.g. the rows of a page, written by a ModelSerializer
+'''
+
+
+class RawJSON(bytes):
+    pass
+
+
+def has_raw_json(obj):
+    if isinstance(obj, RawJSON):
+        return True
+    if isinstance(obj, dict):
+        return any(has_raw_json(value) for value in obj.values())
+    if isinstance(obj, (list, tuple)):
+        return any(has_raw_json(value) for value in obj)
+    return False
+
+
+def encode(obj):
+    '''JSON of obj as bytes, RawJSON values at any depth are embedded as is'''
+    if isinstance(obj, RawJSON):
+        return obj
+    if not has_raw_json(obj):
+        return dumps(obj)
+    if isinstance(obj, dict):
+        return b'{' + b','.join(dumps(str(key)) + b':' + encode(value)
+                                for key, value in obj.items()) + b'}'
+    return b'[' + b','.join(encode(value) for value in obj) + b']'
+
+
+def jsonify(*args, **kwargs):
+    '''
+    flask.jsonify with the JSON_ENCODER library
+        keys keep their order. responses are indented only when the
+        JSONIFY_PRETTYPRINT_REGULAR config is set (see app.create_app), not
+        in debug mode like flask.jsonify does.
+    '''
+    if args and kwargs:
+        raise TypeError('jsonify() behavior undefined when passed both args '
+                        'and kwargs')
+    data = args[0] if len(args) == 1 else args or kwargs
+
+    body = encode(data)
+    if current_app.config['JSONIFY_PRETTYPRINT_REGULAR']:
+        body = dumps(loads(body), indent=2)
+
+    return current_app.response_class(
+        body + b'\n', mimetype=current_app.config['JSONIFY_MIMETYPE'])
+
+
+def format_date(value):
+    '''Dates of the API, MM/DD/YYYY'''
+    if value is None:
+        return None
+    return '%02d/%02d/%04d' % (value.month, value.day, value.year)
+
+
+def encode_date(value):
+    if value is None:
+        return b'null'
+    return b'"%02d/%02d/%04d"' % (value.month, value.day, value.year)
+
+
+'''
+ModelSerializer
+Serialises the `fields` of a model's rows, compiled once per model and fields
+
+    the functions are generated from the column types, so there is no
+    per-row loop over the fields nor getattr:
+        to_dict(row): dict of the fields, for responses that extend rows
+        encode(row): JSON object of the row as bytes
+        to_json(row) / many(rows): RawJSON object of the row / array of the
+        rows
+    with the stdlib encoder, rows are written straight from the attributes,
+    without intermediate dicts nor a json.dumps call per row. orjson encodes
+    the dicts of a whole page faster than Python joins fragments, so with it
+    rows go through to_dict (see bench_json.py).
+    rows can be model instances or result rows with the same attributes
+    (e.g. UPDATE ... RETURNING). DateTime fields are formatted MM/DD/YYYY.
+'''
+
+
+class ModelSerializer:
+
+    def __init__(self, model, fields):
+        self.model = model
+        self.fields = tuple(fields)
+        self.write_rows = encode_value is not None
+
+        namespace = {'dumps': dumps, 'encode_value': encode_value,
+                     'format_date': format_date, 'encode_date': encode_date}
+        exec(self.source(), namespace)
+        self.to_dict = namespace['to_dict']
+        self.encode = namespace['encode']
+
+    def source(self):
+        names = []
+        attributes = []
+        dict_items = []
+        json_items = []
+        json_values = []
+        for field in self.fields:
+            if not field.isidentifier():
+                raise ValueError(f'Invalid field {field!r}')
+            attribute = f'row.{field}'
+            name = f'value_{field}'
+            column_type = self.model.__table__.c[field].type
+            if isinstance(column_type, DateTime):
+                dict_items.append(f'{field!r}: format_date({attribute})')
+                json_values.append(f'encode_date({name})')
+            elif isinstance(column_type, Integer):
+                dict_items.append(f'{field!r}: {attribute}')
+                json_values.append(
+                    f"b'null' if {name} is None else b'%d' % {name}")
+            else:
+                dict_items.append(f'{field!r}: {attribute}')
+                json_values.append(f'encode_value({name})')
+            names.append(name)
+            attributes.append(attribute)
+            json_items.append(dumps(field).decode() + ':%b')
+
+        json_format = ('{' + ','.join(json_items) + '}').encode()
+        if self.write_rows:
+            encode = (
+                f'    {", ".join(names)}, = '
+                f'{", ".join(attributes)},\n'
+                f'    return {json_format!r} % ({", ".join(json_values)},)\n')
+        else:
+            encode = '    return dumps(to_dict(row))\n'
+
+        return (
+            'def to_dict(row):\n'
+            f'    return {{{", ".join(dict_items)}}}\n'
+            'def encode(row):\n' + encode)
+
+    def to_json(self, row):
+        return RawJSON(self.encode(row))
+
+    def many(self, rows):
+        if self.write_rows:
+            encode = self.encode
+            return RawJSON(b'[' + b','.join([encode(row) for row in rows]) +
+                           b']')
+
+        to_dict = self.to_dict
+        return RawJSON(dumps([to_dict(row) for row in rows]))
+
+
+# (model, fields) -> ModelSerializer
+_serializers = {}
+
+
+def get_serializer(model, fields=None):
+    '''The ModelSerializer of the fields, by default model.FIELDS'''
+    fields = model.FIELDS if fields is None else tuple(fields)
+    serializer = _serializers.get((model, fields))
+    if serializer is None:
+        serializer = _serializers[model, fields] = \
+            ModelSerializer(model, fields)
+    return serializer
+
+
+set_encoder(JSON_ENCODER)
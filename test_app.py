@@ -3,8 +3,9 @@ import unittest
 import json
 from flask_sqlalchemy import SQLAlchemy
 
-from app import app
-from models import setup_db, Movie, Actor, Cast
+from app import create_app, encode_cursor, MAX_PER_PAGE
+from models import db, Movie, Actor, Cast, RowCount
+from cache import page_cache
 from auth import CASTING_ASSISTANT_TOKEN, EXECUTIVE_PRODUCER_TOKEN, \
     EXPIRED_TOKEN
 
@@ -18,12 +19,11 @@ class TestCase(unittest.TestCase):
 
     def setUp(self):
         """Define test variables and initialize app."""
-        self.app = app
-        self.client = self.app.test_client
         self.database_name = "capstone"
         self.database_path = "postgresql://{}/{}".format(
             'localhost:5432', self.database_name)
-        setup_db(self.app, self.database_path)
+        self.app = create_app({'SQLALCHEMY_DATABASE_URI': self.database_path})
+        self.client = self.app.test_client
 
         # binds the app to the current context
         with self.app.app_context():
@@ -67,6 +67,244 @@ class TestCase(unittest.TestCase):
         self.assertTrue(data['total_movies'])
         self.assertTrue(len(data['movies']))
 
+    def test_get_movies_per_page(self):
+        auth_header = get_auth_header(EXECUTIVE_PRODUCER_TOKEN)
+
+        res = self.client().get('/movies?per_page=1', headers=auth_header)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(len(data['movies']), 1)
+
+    def test_get_movies_per_page_capped(self):
+        auth_header = get_auth_header(EXECUTIVE_PRODUCER_TOKEN)
+
+        res = self.client().get('/movies?per_page=1000000',
+                                headers=auth_header)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertLessEqual(len(data['movies']), MAX_PER_PAGE)
+
+    def test_get_movies_cached_page_invalidated_by_write(self):
+        auth_header = get_auth_header(EXECUTIVE_PRODUCER_TOKEN)
+
+        first = self.client().get('/movies?per_page=5', headers=auth_header)
+        hits = page_cache.hits
+        second = self.client().get('/movies?per_page=5', headers=auth_header)
+
+        self.assertEqual(page_cache.hits, hits + 1)
+        self.assertEqual(first.data, second.data)
+
+        self.client().post('/movies', json={
+            'title': 'Movie E',
+            'release_date': '2021-05-26'
+        }, headers=auth_header)
+        res = self.client().get('/movies?per_page=5', headers=auth_header)
+        data = json.loads(res.data)
+
+        self.assertEqual(page_cache.hits, hits + 1)
+        self.assertEqual(data['total_movies'],
+                         json.loads(first.data)['total_movies'] + 1)
+
+    def test_304_get_movies_not_modified(self):
+        auth_header = get_auth_header(EXECUTIVE_PRODUCER_TOKEN)
+
+        self.client().get('/movies', headers=auth_header)
+        res = self.client().get('/movies', headers=auth_header)
+        etag = res.headers['ETag']
+        res = self.client().get('/movies', headers={
+            **auth_header, 'If-None-Match': etag})
+
+        self.assertEqual(res.status_code, 304)
+        self.assertEqual(res.data, b'')
+        self.assertEqual(res.headers['ETag'], etag)
+
+    def test_get_movies_etag_changes_after_write(self):
+        auth_header = get_auth_header(EXECUTIVE_PRODUCER_TOKEN)
+
+        self.client().get('/movies', headers=auth_header)
+        etag = self.client().get('/movies', headers=auth_header) \
+            .headers['ETag']
+        movie = Movie.query.order_by(Movie.id).all()[0]
+        self.client().patch(f'/movies/{movie.id}', json={
+            'title': 'Movie F'
+        }, headers=auth_header)
+        res = self.client().get('/movies', headers={
+            **auth_header, 'If-None-Match': etag})
+
+        self.assertEqual(res.status_code, 200)
+        self.assertNotEqual(res.headers['ETag'], etag)
+
+    def test_get_movies_cached_page_after_write_of_other_process(self):
+        auth_header = get_auth_header(EXECUTIVE_PRODUCER_TOKEN)
+
+        first = self.client().get('/movies?per_page=5', headers=auth_header)
+        etag = first.headers['ETag']
+        # another process writes: only the shared counter row moves
+        with self.app.app_context():
+            movie_id = json.loads(first.data)['movies'][0]['id']
+            db.session.execute(
+                Movie.__table__.update().where(Movie.id == movie_id)
+                .values(title='Movie G'))
+            db.session.query(RowCount) \
+                .filter(RowCount.table_name == Movie.__tablename__) \
+                .update({RowCount.version: RowCount.version + 1},
+                        synchronize_session=False)
+            db.session.commit()
+        res = self.client().get('/movies?per_page=5', headers={
+            **auth_header, 'If-None-Match': etag})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertNotEqual(res.headers['ETag'], etag)
+        self.assertEqual(data['movies'][0]['title'], 'Movie G')
+
+    def test_get_movies_sparse_fields(self):
+        auth_header = get_auth_header(EXECUTIVE_PRODUCER_TOKEN)
+
+        res = self.client().get('/movies?fields=id,title', headers=auth_header)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(set(data['movies'][0]), {'id', 'title'})
+
+    def test_400_get_movies_unknown_field(self):
+        auth_header = get_auth_header(EXECUTIVE_PRODUCER_TOKEN)
+
+        res = self.client().get('/movies?fields=id,budget',
+                                headers=auth_header)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data['success'], False)
+
+    def test_export_movies(self):
+        auth_header = get_auth_header(EXECUTIVE_PRODUCER_TOKEN)
+
+        res = self.client().get('/movies/export', headers=auth_header)
+        lines = res.data.decode().splitlines()
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.mimetype, 'application/x-ndjson')
+        self.assertEqual(len(lines), Movie.query.count())
+        self.assertIn('title', json.loads(lines[0]))
+
+    def test_get_movies_include_actors(self):
+        auth_header = get_auth_header(EXECUTIVE_PRODUCER_TOKEN)
+
+        res = self.client().get('/movies?include=actors', headers=auth_header)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        for movie in data['movies']:
+            self.assertIsInstance(movie['actors'], list)
+
+    def test_400_get_movies_unknown_include(self):
+        auth_header = get_auth_header(EXECUTIVE_PRODUCER_TOKEN)
+
+        res = self.client().get('/movies?include=directors',
+                                headers=auth_header)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data['success'], False)
+
+    def test_get_movies_estimated_count(self):
+        auth_header = get_auth_header(EXECUTIVE_PRODUCER_TOKEN)
+
+        res = self.client().get('/movies?count=estimate', headers=auth_header)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertGreaterEqual(data['total_movies'], 0)
+
+    def test_400_get_movies_estimated_count_with_filter(self):
+        auth_header = get_auth_header(EXECUTIVE_PRODUCER_TOKEN)
+
+        res = self.client().get('/movies?count=estimate&title_prefix=M',
+                                headers=auth_header)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data['success'], False)
+
+    def test_400_get_movies_invalid_count(self):
+        auth_header = get_auth_header(EXECUTIVE_PRODUCER_TOKEN)
+
+        res = self.client().get('/movies?count=invalid', headers=auth_header)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data['success'], False)
+
+    def test_get_movies_cursor(self):
+        auth_header = get_auth_header(EXECUTIVE_PRODUCER_TOKEN)
+
+        res = self.client().get('/movies?cursor=&sort=release_date&per_page=1',
+                                headers=auth_header)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(len(data['movies']), 1)
+        self.assertIn('next_cursor', data)
+
+        if data['next_cursor']:
+            res = self.client().get(
+                f'/movies?cursor={data["next_cursor"]}&per_page=1',
+                headers=auth_header)
+            next_data = json.loads(res.data)
+
+            self.assertEqual(res.status_code, 200)
+            self.assertNotEqual(next_data['movies'][0]['id'],
+                                data['movies'][0]['id'])
+
+    def test_get_movies_filtered_and_sorted(self):
+        auth_header = get_auth_header(EXECUTIVE_PRODUCER_TOKEN)
+
+        res = self.client().get('/movies?title_prefix=Movie&sort=title'
+                                '&release_date_from=2000-01-01',
+                                headers=auth_header)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        titles = [movie['title'] for movie in data['movies']]
+        self.assertEqual(titles, sorted(titles))
+        self.assertTrue(all(title.startswith('Movie') for title in titles))
+        self.assertGreaterEqual(data['total_movies'], len(titles))
+
+    def test_400_get_movies_unindexed_sort(self):
+        auth_header = get_auth_header(EXECUTIVE_PRODUCER_TOKEN)
+
+        res = self.client().get('/movies?sort=casts', headers=auth_header)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data['success'], False)
+
+    def test_400_get_movies_invalid_cursor(self):
+        auth_header = get_auth_header(EXECUTIVE_PRODUCER_TOKEN)
+
+        res = self.client().get('/movies?cursor=invalid', headers=auth_header)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data['success'], False)
+
+    def test_400_get_actors_cursor_of_wrong_type(self):
+        auth_header = get_auth_header(EXECUTIVE_PRODUCER_TOKEN)
+
+        for cursor in (encode_cursor('age', 'abc', 1),
+                       encode_cursor('name', 5, 1),
+                       encode_cursor('age', 2 ** 40, 1),
+                       encode_cursor('id', 1, 2 ** 40)):
+            res = self.client().get(f'/actors?cursor={cursor}',
+                                    headers=auth_header)
+            data = json.loads(res.data)
+
+            self.assertEqual(res.status_code, 400)
+            self.assertEqual(data['success'], False)
+
     def test_404_get_movies(self):
         auth_header = get_auth_header(EXECUTIVE_PRODUCER_TOKEN)
 
@@ -77,6 +315,29 @@ class TestCase(unittest.TestCase):
         self.assertEqual(data['success'], False)
         self.assertEqual(data['message'], 'resource not found')
 
+    def test_404_get_movies_page_past_bigint(self):
+        auth_header = get_auth_header(EXECUTIVE_PRODUCER_TOKEN)
+
+        res = self.client().get('/movies?page=99999999999999999999',
+                                headers=auth_header)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 404)
+        self.assertEqual(data['success'], False)
+
+    def test_search_movies_with_typo(self):
+        auth_header = get_auth_header(EXECUTIVE_PRODUCER_TOKEN)
+        self.client().post('/movies', json={'title': 'Godfather',
+                                            'release_date': '03/24/1972'},
+                           headers=auth_header)
+
+        res = self.client().get('/movies/search?q=godfater',
+                                headers=auth_header)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['movies'][0]['title'], 'Godfather')
+
     def test_create_movie(self):
         new_movie = {
             'title': 'Movie D',
@@ -102,6 +363,63 @@ class TestCase(unittest.TestCase):
         self.assertEqual(data['success'], False)
         self.assertEqual(data['message'], 'bad request')
 
+    def test_bulk_create_movies(self):
+        new_movies = [
+            {'title': 'Movie G', 'release_date': '2021-05-27'},
+            {'title': 'Movie H', 'release_date': 'not a date'},
+            {'title': 'Movie I'}
+        ]
+        auth_header = get_auth_header(EXECUTIVE_PRODUCER_TOKEN)
+
+        res = self.client().post('/movies/bulk', json=new_movies,
+                                 headers=auth_header)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['created'], 2)
+        self.assertEqual([error['index'] for error in data['errors']], [1])
+
+    def test_bulk_create_actors_ndjson(self):
+        body = '{"name": "Bob", "age": 30, "gender": "M"}\n' \
+            '{"name": "Carol", "age": "thirty"}\n'
+        auth_header = get_auth_header(EXECUTIVE_PRODUCER_TOKEN)
+
+        res = self.client().post('/actors/bulk', data=body, headers={
+            **auth_header, 'Content-Type': 'application/x-ndjson'})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['created'], 1)
+        self.assertEqual(data['errors'][0]['index'], 1)
+
+    def test_bulk_create_actors_invalid_ages(self):
+        new_actors = [
+            {'name': 'Dan', 'age': True},
+            {'name': 'Eve', 'age': 30.5},
+            {'name': 'Fay', 'age': 2 ** 31},
+            {'name': 'Gus', 'age': 41, 'gender': 'M'}
+        ]
+        auth_header = get_auth_header(EXECUTIVE_PRODUCER_TOKEN)
+
+        res = self.client().post('/actors/bulk', json=new_actors,
+                                 headers=auth_header)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['created'], 1)
+        self.assertEqual([error['index'] for error in data['errors']],
+                         [0, 1, 2])
+
+    def test_400_bulk_create_movies(self):
+        auth_header = get_auth_header(EXECUTIVE_PRODUCER_TOKEN)
+
+        res = self.client().post('/movies/bulk', json={'title': 'Movie J'},
+                                 headers=auth_header)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data['success'], False)
+
     def test_update_movies(self):
         updated_movie = {
             'release_date': '2030-05-25'
@@ -117,6 +435,20 @@ class TestCase(unittest.TestCase):
         self.assertEqual(data['success'], True)
         self.assertEqual(data['updated_id'], movie.id)
 
+    def test_update_movie_keeps_omitted_fields(self):
+        auth_header = get_auth_header(EXECUTIVE_PRODUCER_TOKEN)
+
+        movie = Movie.query.order_by(Movie.id).all()[0]
+        res = self.client().patch(
+            f'/movies/{movie.id}', json={'title': 'Movie E'},
+            headers=auth_header)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['updated_movie']['title'], 'Movie E')
+        self.assertEqual(data['updated_movie']['release_date'],
+                         movie.release_date.strftime("%m/%d/%Y"))
+
     def test_404_update_invalid_movie(self):
         updated_movie = {
             'release_date': '2030-05-25'
@@ -155,6 +487,82 @@ class TestCase(unittest.TestCase):
         self.assertEqual(res.status_code, 200)
         self.assertEqual(data['success'], True)
 
+    def test_delete_movie_cascades_casts(self):
+        auth_header = get_auth_header(EXECUTIVE_PRODUCER_TOKEN)
+        movie = Movie(title='Movie C', release_date='05/25/2021')
+        movie.insert()
+        actor = Actor(name='Bob', age=30, gender='M')
+        actor.insert()
+        Cast(movie_id=movie.id, actor_id=actor.id).insert()
+
+        res = self.client().delete(f'/movies/{movie.id}', headers=auth_header)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(Cast.query.filter(Cast.movie_id == movie.id).count(),
+                         0)
+
+    def test_bulk_update_movies(self):
+        auth_header = get_auth_header(EXECUTIVE_PRODUCER_TOKEN)
+
+        ids = [movie.id for movie in Movie.query.order_by(Movie.id).all()[:2]]
+        res = self.client().patch('/movies/bulk', json={
+            'ids': ids,
+            'set': {'release_date': '2031-01-01'}
+        }, headers=auth_header)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['updated'], len(ids))
+
+    def test_422_bulk_update_movies_with_null(self):
+        auth_header = get_auth_header(EXECUTIVE_PRODUCER_TOKEN)
+
+        res = self.client().patch('/movies/bulk', json={
+            'ids': [1],
+            'set': {'release_date': None}
+        }, headers=auth_header)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 422)
+        self.assertEqual(data['success'], False)
+
+    def test_400_bulk_update_movies_without_target(self):
+        auth_header = get_auth_header(EXECUTIVE_PRODUCER_TOKEN)
+
+        res = self.client().patch('/movies/bulk', json={
+            'set': {'title': 'Movie K'}
+        }, headers=auth_header)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data['success'], False)
+
+    def test_bulk_delete_movies_by_filter(self):
+        auth_header = get_auth_header(EXECUTIVE_PRODUCER_TOKEN)
+
+        self.client().post('/movies', json={
+            'title': 'Movie L',
+            'release_date': '1901-01-01'
+        }, headers=auth_header)
+        res = self.client().delete('/movies/bulk', json={
+            'filter': {'release_date_to': '1901-12-31'}
+        }, headers=auth_header)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertGreaterEqual(data['deleted'], 1)
+
+    def test_404_bulk_delete_invalid_movies(self):
+        auth_header = get_auth_header(EXECUTIVE_PRODUCER_TOKEN)
+
+        res = self.client().delete('/movies/bulk', json={
+            'ids': [1000000, 1000001]
+        }, headers=auth_header)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 404)
+        self.assertEqual(data['success'], False)
+
     def test_404_delete_invalid_movie(self):
         auth_header = get_auth_header(EXECUTIVE_PRODUCER_TOKEN)
 
@@ -179,6 +587,71 @@ class TestCase(unittest.TestCase):
         self.assertTrue(data['total_actors'])
         self.assertTrue(len(data['actors']))
 
+    def test_get_actors_filtered_by_age_and_gender(self):
+        auth_header = get_auth_header(EXECUTIVE_PRODUCER_TOKEN)
+
+        res = self.client().get('/actors?gender=F&age_min=20&age_max=40'
+                                '&sort=age', headers=auth_header)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        ages = [actor['age'] for actor in data['actors']]
+        self.assertEqual(ages, sorted(ages))
+        for actor in data['actors']:
+            self.assertEqual(actor['gender'], 'F')
+            self.assertTrue(20 <= actor['age'] <= 40)
+
+    def test_get_actors_include_movies(self):
+        auth_header = get_auth_header(EXECUTIVE_PRODUCER_TOKEN)
+
+        res = self.client().get('/actors?include=movies', headers=auth_header)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        for actor in data['actors']:
+            self.assertIsInstance(actor['movies'], list)
+
+    def test_400_search_actors_without_query(self):
+        auth_header = get_auth_header(EXECUTIVE_PRODUCER_TOKEN)
+
+        res = self.client().get('/actors/search?q=', headers=auth_header)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data['success'], False)
+
+    def test_get_costars(self):
+        auth_header = get_auth_header(EXECUTIVE_PRODUCER_TOKEN)
+
+        actor = Actor.query.order_by(Actor.id).all()[0]
+        res = self.client().get(f'/actors/{actor.id}/costars',
+                                headers=auth_header)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['actor_id'], actor.id)
+        self.assertEqual(data['total_costars'], len(data['costars']))
+
+    def test_404_get_costars(self):
+        auth_header = get_auth_header(EXECUTIVE_PRODUCER_TOKEN)
+
+        res = self.client().get('/actors/1000000/costars',
+                                headers=auth_header)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 404)
+        self.assertEqual(data['success'], False)
+
+    def test_404_get_collaboration_path(self):
+        auth_header = get_auth_header(EXECUTIVE_PRODUCER_TOKEN)
+
+        res = self.client().get('/actors/1000000/path/1000001',
+                                headers=auth_header)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 404)
+        self.assertEqual(data['success'], False)
+
     def test_404_get_actors(self):
         auth_header = get_auth_header(EXECUTIVE_PRODUCER_TOKEN)
 
@@ -315,6 +788,28 @@ class TestCase(unittest.TestCase):
         self.assertEqual(res.status_code, 401)
         self.assertEqual(data['code'], "unauthorized")
 
+    def test_get_pool_metrics_page_cache(self):
+        auth_header = get_auth_header(EXECUTIVE_PRODUCER_TOKEN)
+
+        self.client().get('/movies?per_page=3', headers=auth_header)
+        self.client().get('/movies?per_page=3', headers=auth_header)
+        res = self.client().get('/admin/pool', headers=auth_header)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['page_cache'], page_cache.stats())
+        self.assertGreaterEqual(data['page_cache']['hits'], 1)
+        self.assertGreaterEqual(data['page_cache']['entries'], 1)
+
+    def test_401_unauthorized_pool_metrics(self):
+        auth_header = get_auth_header(CASTING_ASSISTANT_TOKEN)
+
+        res = self.client().get('/admin/pool', headers=auth_header)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 401)
+        self.assertEqual(data['code'], "unauthorized")
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,62 @@
+import json
+import asyncio
+import unittest
+
+from asgi import WSGIApplication
+from app import app
+
+
+def call(application, path, method='GET', headers=(), body=b''):
+    '''Runs one request through the ASGI app, returns (status, body)'''
+    scope = {
+        'type': 'http',
+        'method': method,
+        'path': path,
+        'query_string': b'',
+        'http_version': '1.1',
+        'headers': [(name.encode(), value.encode())
+                    for name, value in headers]
+    }
+    requests = [{'type': 'http.request', 'body': body}]
+    messages = []
+
+    async def receive():
+        return requests.pop(0)
+
+    async def send(message):
+        messages.append(message)
+
+    asyncio.run(application(scope, receive, send))
+    body = b''.join(message.get('body', b'') for message in messages[1:])
+    return messages[0]['status'], json.loads(body)
+
+
+class ASGITestCase(unittest.TestCase):
+    """This class tests the ASGI entry point without a server or database"""
+
+    def setUp(self):
+        self.application = WSGIApplication(app, threads=2)
+
+    def test_get(self):
+        status, data = call(self.application, '/')
+
+        self.assertEqual(status, 200)
+        self.assertEqual(data['greeting'], 'Hello')
+
+    def test_auth_error(self):
+        status, data = call(self.application, '/movies')
+
+        self.assertEqual(status, 401)
+        self.assertEqual(data['code'], 'authorization_header_missing')
+
+    def test_error_handler(self):
+        status, data = call(self.application, '/movies/1', method='PUT',
+                            headers=[('content-type', 'application/json')],
+                            body=b'{}')
+
+        self.assertEqual(status, 405)
+        self.assertEqual(data['message'], 'method not allowed')
+
+
+if __name__ == "__main__":
+    unittest.main()
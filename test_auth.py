@@ -0,0 +1,187 @@
+import json
+import time
+import tempfile
+import unittest
+import threading
+
+import auth
+from jose import jwt
+from jose.exceptions import JWSError
+
+from auth import AuthError, JWKSCache, VerifiedTokenCache, \
+    verify_decode_jwt, verify_signature, check_permissions, load_jwks_file
+from jwks_stub import LocalIssuer, StubJWKSServer
+
+
+class JWKSCacheTestCase(unittest.TestCase):
+    """This class tests the JWKS cache against a local stub server"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.issuer = LocalIssuer(key_size=1024)
+        cls.server = StubJWKSServer(cls.issuer).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+
+    def setUp(self):
+        self.server.delay = 0
+        self.server.request_count = 0
+        self.original_cache = auth.jwks_cache
+        self.original_token_cache = auth.token_cache
+        auth.jwks_cache = JWKSCache(self.server.url, ttl=600,
+                                    min_refresh_interval=0)
+        auth.token_cache = VerifiedTokenCache(maxsize=0)
+
+    def tearDown(self):
+        auth.jwks_cache = self.original_cache
+        auth.token_cache = self.original_token_cache
+
+    def test_key_set_fetched_once(self):
+        token = self.issuer.mint(['get:movies'])
+
+        for _ in range(5):
+            payload = verify_decode_jwt(token)
+
+        self.assertEqual(payload['permissions'], ['get:movies'])
+        self.assertEqual(auth.jwks_cache.fetch_count, 1)
+
+    def test_unknown_kid_forces_refetch(self):
+        verify_decode_jwt(self.issuer.mint(['get:movies']))
+        self.issuer.rotate()
+
+        payload = verify_decode_jwt(self.issuer.mint(['get:actors']))
+
+        self.assertEqual(payload['permissions'], ['get:actors'])
+        self.assertEqual(auth.jwks_cache.fetch_count, 2)
+
+    def test_unknown_kid_refetch_is_rate_limited(self):
+        auth.jwks_cache.min_refresh_interval = 600
+        verify_decode_jwt(self.issuer.mint(['get:movies']))
+        self.issuer.rotate()
+
+        with self.assertRaises(AuthError) as context:
+            verify_decode_jwt(self.issuer.mint(['get:movies']))
+
+        self.assertEqual(context.exception.status_code, 401)
+        self.assertEqual(auth.jwks_cache.fetch_count, 1)
+
+    def test_concurrent_cold_fetch_is_single_flight(self):
+        self.server.delay = 0.2
+        token = self.issuer.mint(['get:movies'])
+        threads = [threading.Thread(target=verify_decode_jwt, args=(token,))
+                   for _ in range(8)]
+
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(auth.jwks_cache.fetch_count, 1)
+
+    def test_stale_keys_served_during_background_refresh(self):
+        token = self.issuer.mint(['get:movies'])
+        verify_decode_jwt(token)
+        auth.jwks_cache.ttl = 0
+        self.server.delay = 0.5
+
+        start = time.monotonic()
+        verify_decode_jwt(token)
+        elapsed = time.monotonic() - start
+
+        self.assertLess(elapsed, self.server.delay)
+        background_refresh = auth.jwks_cache._background_refresh
+        if background_refresh is not None:
+            background_refresh.join()
+        self.assertEqual(auth.jwks_cache.fetch_count, 2)
+
+    def test_tampered_signature_rejected(self):
+        token = self.issuer.mint(['get:movies'])
+        header, payload, signature = token.split('.')
+        forged = self.issuer.mint(['delete:movies']).split('.')[1]
+
+        with self.assertRaises(AuthError) as context:
+            verify_decode_jwt('.'.join([header, forged, signature]))
+
+        self.assertEqual(context.exception.status_code, 400)
+
+    def test_partial_alg_rejected(self):
+        token = self.issuer.mint(['get:movies'])
+        header = jwt.get_unverified_header(token)
+        key = auth.jwks_cache.get_key(header['kid'])
+        self.assertEqual(auth.allowed_algorithms(), ['RS256'])
+
+        verify_signature(token, header, key)
+        for alg in ('RS2', 'S256', '', None):
+            with self.assertRaises(JWSError):
+                verify_signature(token, dict(header, alg=alg), key)
+
+    def test_offline_key_file(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.json') as f:
+            json.dump(self.issuer.jwks(), f)
+            f.flush()
+            auth.jwks_cache = JWKSCache(source=lambda: load_jwks_file(f.name))
+
+            payload = verify_decode_jwt(self.issuer.mint(['get:movies']))
+
+        self.assertEqual(payload['permissions'], ['get:movies'])
+        self.assertEqual(self.server.request_count, 0)
+
+
+class VerifiedTokenCacheTestCase(unittest.TestCase):
+    """This class tests the verified token cache"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.issuer = LocalIssuer(key_size=1024)
+        cls.server = StubJWKSServer(cls.issuer).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+
+    def setUp(self):
+        self.original_cache = auth.jwks_cache
+        self.original_token_cache = auth.token_cache
+        auth.jwks_cache = JWKSCache(self.server.url)
+        auth.token_cache = VerifiedTokenCache(maxsize=2, ttl=300)
+
+    def tearDown(self):
+        auth.jwks_cache = self.original_cache
+        auth.token_cache = self.original_token_cache
+
+    def test_repeated_token_hits_cache(self):
+        token = self.issuer.mint(['get:movies'])
+
+        verify_decode_jwt(token)
+        payload = verify_decode_jwt(token)
+
+        self.assertTrue(check_permissions('get:movies', payload))
+        self.assertEqual(auth.token_cache.hits, 1)
+        self.assertEqual(auth.token_cache.misses, 1)
+
+    def test_entry_expires_with_token(self):
+        token = self.issuer.mint(['get:movies'], expires_in=1)
+        verify_decode_jwt(token)
+        time.sleep(2)
+
+        with self.assertRaises(AuthError) as context:
+            verify_decode_jwt(token)
+
+        self.assertEqual(context.exception.error['code'], 'token_expired')
+
+    def test_least_recently_used_entry_evicted(self):
+        tokens = [self.issuer.mint(['get:movies'], sub=f'user-{i}')
+                  for i in range(3)]
+
+        for token in tokens:
+            verify_decode_jwt(token)
+        verify_decode_jwt(tokens[0])
+
+        self.assertEqual(auth.token_cache.stats()['size'], 2)
+        self.assertEqual(auth.token_cache.hits, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
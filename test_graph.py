@@ -0,0 +1,57 @@
+import unittest
+
+from graph import CastGraph
+
+
+class CastGraphTestCase(unittest.TestCase):
+    """This class tests the co-star graph index"""
+
+    def setUp(self):
+        # movie 1: actors 1, 2 / movie 2: actors 2, 3 / movie 3: actors 3, 4
+        # movie 4: actors 1, 2 / actor 5 is not connected
+        self.rows = [(1, 1), (1, 2), (2, 2), (2, 3), (3, 3), (3, 4),
+                     (4, 1), (4, 2), (5, 5)]
+        self.graph = CastGraph(lambda: self.rows)
+
+    def test_costars(self):
+        self.assertEqual(self.graph.costars(2), [(1, 2), (3, 1)])
+        self.assertEqual(self.graph.costars(5), [])
+        self.assertEqual(self.graph.costars(1000000), [])
+
+    def test_shortest_path(self):
+        actor_ids, movie_ids = self.graph.shortest_path(1, 4)
+
+        self.assertEqual(actor_ids, [1, 2, 3, 4])
+        self.assertEqual(movie_ids[1:], [2, 3])
+
+    def test_no_path(self):
+        self.assertIsNone(self.graph.shortest_path(1, 5))
+        self.assertIsNone(self.graph.shortest_path(1, 1000000))
+
+    def test_incremental_updates(self):
+        self.graph.costars(1)
+        self.graph.add_cast(6, 1)
+        self.graph.add_cast(6, 4)
+
+        self.assertEqual(self.graph.shortest_path(1, 4), ([1, 4], [6]))
+
+        self.graph.remove_cast(6, 4)
+        self.graph.remove_movie(1)
+        self.graph.remove_actor(3)
+
+        self.assertEqual(self.graph.costars(1), [(2, 1)])
+        self.assertIsNone(self.graph.shortest_path(1, 4))
+        self.assertEqual(self.graph.build_count, 1)
+
+    def test_invalidate_rebuilds(self):
+        self.graph.costars(1)
+        self.rows.append((7, 5))
+        self.rows.append((7, 1))
+        self.graph.invalidate()
+
+        self.assertEqual(self.graph.costars(5), [(1, 1)])
+        self.assertEqual(self.graph.build_count, 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
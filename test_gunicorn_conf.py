@@ -0,0 +1,46 @@
+import os
+import runpy
+import unittest
+from unittest import mock
+
+from app import app
+
+
+def load_config(**environ):
+    with mock.patch.dict(os.environ, environ):
+        return runpy.run_path('gunicorn.conf.py')
+
+
+class GunicornConfTestCase(unittest.TestCase):
+    """This class tests the gunicorn configuration without a server"""
+
+    def test_worker_sizing(self):
+        config = load_config(GUNICORN_WORKER_CLASS='sync')
+        self.assertEqual(config['worker_class'], 'sync')
+        self.assertEqual(config['workers'], 2 * config['CPU_COUNT'] + 1)
+        self.assertTrue(config['preload_app'])
+
+        config = load_config(GUNICORN_WORKER_CLASS='gthread',
+                             WEB_CONCURRENCY='3', GUNICORN_THREADS='6')
+        self.assertEqual(config['workers'], 3)
+        self.assertEqual(config['threads'], 6)
+
+        with self.assertRaises(ValueError):
+            load_config(GUNICORN_WORKER_CLASS='eventlet')
+
+    def test_master_closes_connections_before_fork(self):
+        config = load_config()
+        with mock.patch('app.warm_up') as warm_up, \
+                mock.patch('models.dispose_engines') as dispose_engines, \
+                mock.patch('gc.freeze'):
+            config['when_ready'](None)
+            warm_up.assert_called_once_with()
+            dispose_engines.assert_called_once_with(app)
+
+            config['post_fork'](None, None)
+            self.assertEqual(dispose_engines.call_count, 2)
+
+
+# Make the tests conveniently executable
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,78 @@
+import time
+import tempfile
+import unittest
+import threading
+
+from sqlalchemy import create_engine
+
+from pool import WaitHistogram, TimedQueuePool, TimedNullPool, \
+    engine_options, pool_status, pool_wait_histogram
+
+
+class WaitHistogramTestCase(unittest.TestCase):
+    """This class tests the pool wait histogram"""
+
+    def test_counts_are_cumulative(self):
+        histogram = WaitHistogram(buckets=(0.01, 0.1))
+
+        for seconds in (0.001, 0.05, 0.05, 2):
+            histogram.observe(seconds)
+        stats = histogram.stats()
+
+        self.assertEqual([bucket['count'] for bucket in stats['buckets']],
+                         [1, 3, 4])
+        self.assertEqual(stats['count'], 4)
+        self.assertEqual(stats['max'], 2)
+
+
+class PoolTestCase(unittest.TestCase):
+    """This class tests the timed pool and the engine options"""
+
+    def setUp(self):
+        self.database_file = tempfile.NamedTemporaryFile(suffix='.db')
+        self.engine = create_engine(
+            f'sqlite:///{self.database_file.name}',
+            poolclass=TimedQueuePool, pool_size=1, max_overflow=0,
+            pool_timeout=5)
+        pool_wait_histogram.clear()
+
+    def tearDown(self):
+        self.engine.dispose()
+        self.database_file.close()
+
+    def test_wait_for_busy_pool_is_recorded(self):
+        connection = self.engine.connect()
+        waiter = threading.Thread(
+            target=lambda: self.engine.connect().close())
+
+        waiter.start()
+        time.sleep(0.2)
+        status = pool_status(self.engine.pool)
+        connection.close()
+        waiter.join()
+
+        self.assertEqual(status['checked_out'], 1)
+        self.assertEqual(status['idle'], 0)
+        self.assertGreaterEqual(pool_wait_histogram.max, 0.2)
+        self.assertEqual(pool_status(self.engine.pool)['idle'], 1)
+
+    def test_pgbouncer_mode(self):
+        options = engine_options('postgresql://localhost/capstone',
+                                 pgbouncer=True)
+
+        self.assertIs(options['poolclass'], TimedNullPool)
+        self.assertNotIn('pool_size', options)
+        self.assertNotIn('connect_args', options)
+
+    def test_statement_timeout_only_on_postgres(self):
+        postgres = engine_options('postgresql://localhost/capstone',
+                                  pgbouncer=False)
+        sqlite = engine_options('sqlite://', pgbouncer=False)
+
+        self.assertIn('statement_timeout',
+                      postgres['connect_args']['options'])
+        self.assertNotIn('options', sqlite['connect_args'])
+
+
+if __name__ == "__main__":
+    unittest.main()
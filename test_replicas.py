@@ -0,0 +1,141 @@
+import time
+import tempfile
+import unittest
+
+from flask import Flask, g, jsonify
+from sqlalchemy import create_engine
+
+from models import setup_db, db, Movie
+from replicas import replica_may_lag
+
+
+def create_database(path, titles):
+    engine = create_engine(f'sqlite:///{path}')
+    engine.execute('CREATE TABLE movies (id INTEGER PRIMARY KEY, '
+                   'title VARCHAR, release_date DATETIME, '
+                   'search_vector TEXT)')
+    engine.execute('CREATE TABLE row_counts (table_name VARCHAR PRIMARY KEY, '
+                   'row_count BIGINT, version BIGINT)')
+    for title in titles:
+        engine.execute('INSERT INTO movies (title) VALUES (?)', title)
+    engine.dispose()
+
+
+class ReplicaRoutingTestCase(unittest.TestCase):
+    """This class tests read replica routing with two SQLite databases"""
+
+    def setUp(self):
+        # the replica is told apart by its rows, it does not replicate
+        self.primary = tempfile.NamedTemporaryFile(suffix='.db')
+        self.replica = tempfile.NamedTemporaryFile(suffix='.db')
+        create_database(self.primary.name, ['primary'])
+        create_database(self.replica.name, ['replica'])
+        self.app = self.create_app(f'sqlite:///{self.replica.name}')
+        self.router = self.app.extensions['replica_router']
+
+    def tearDown(self):
+        with self.app.app_context():
+            db.get_engine(self.app).dispose()
+            db.get_engine(self.app, bind='replica_0').dispose()
+        self.primary.close()
+        self.replica.close()
+
+    def create_app(self, replica_path):
+        app = Flask(__name__)
+        setup_db(app, f'sqlite:///{self.primary.name}', [replica_path])
+
+        @app.route('/titles', methods=['GET', 'POST'])
+        def titles():
+            return jsonify([movie.title for movie in Movie.query])
+
+        return app
+
+    def get_titles(self, method='GET', cookie=None, app=None):
+        client = (app or self.app).test_client(use_cookies=False)
+        headers = {} if cookie is None else {'Cookie': cookie}
+        return client.open('/titles', method=method, headers=headers)
+
+    def write(self, app=None):
+        '''POSTs, returns the Cookie header of the write cookie'''
+        res = self.get_titles('POST', app=app)
+        return res.headers['Set-Cookie'].split(';')[0]
+
+    def test_get_reads_from_replica(self):
+        self.assertEqual(self.get_titles().get_json(), ['replica'])
+        self.assertEqual(self.router.replica_reads, 1)
+
+    def test_write_requests_use_primary(self):
+        self.assertEqual(self.get_titles('POST').get_json(),
+                         ['primary'])
+
+    def test_read_your_writes(self):
+        cookie = self.write()
+
+        self.assertEqual(self.get_titles(cookie=cookie).get_json(),
+                         ['primary'])
+        self.assertEqual(self.get_titles().get_json(), ['replica'])
+
+        self.router.read_your_writes = 0
+        self.assertEqual(self.get_titles(cookie=cookie).get_json(),
+                         ['replica'])
+
+    def test_read_your_writes_across_routers(self):
+        # e.g. two gunicorn workers, which share no memory
+        other_app = self.create_app(f'sqlite:///{self.replica.name}')
+        cookie = self.write(app=other_app)
+
+        self.assertEqual(self.get_titles(cookie=cookie).get_json(),
+                         ['primary'])
+        self.assertEqual(self.router.primary_reads, 1)
+        with other_app.app_context():
+            db.get_engine(other_app).dispose()
+            db.get_engine(other_app, bind='replica_0').dispose()
+
+    def test_future_write_cookie_is_ignored(self):
+        cookie = f'db_written_at={time.time() + 3600}'
+        self.assertEqual(self.get_titles(cookie=cookie).get_json(),
+                         ['replica'])
+
+    def test_replica_may_lag_after_a_write(self):
+        with self.app.test_request_context():
+            g.db_replica = 'replica_0'
+            self.assertFalse(replica_may_lag())
+        self.write()
+        with self.app.test_request_context():
+            g.db_replica = 'replica_0'
+            self.assertTrue(replica_may_lag())
+            g.db_replica = None
+            self.assertFalse(replica_may_lag())
+
+    def test_empty_update_reads_primary(self):
+        with self.app.test_request_context():
+            g.db_replica = 'replica_0'
+            self.assertEqual(Movie.query.first().title, 'replica')
+            self.assertEqual(Movie.update_by_id(1, {}).title, 'primary')
+            db.session.remove()
+
+    def test_fallback_when_replica_lags(self):
+        self.router.max_lag = -1
+
+        self.assertEqual(self.get_titles().get_json(), ['primary'])
+        self.assertEqual(self.router.primary_reads, 1)
+
+    def test_fallback_when_replica_is_down(self):
+        self.app = self.create_app('sqlite:////nonexistent/replica.db')
+        self.router = self.app.extensions['replica_router']
+
+        self.assertEqual(self.get_titles().get_json(), ['primary'])
+        self.assertTrue(self.router.stats()['replicas']['replica_0']['down'])
+
+    def test_fallback_when_replica_fails_between_checks(self):
+        self.app = self.create_app('sqlite:////nonexistent/replica.db')
+        self.router = self.app.extensions['replica_router']
+        # the last check passed, the replica went down since
+        self.router._checks['replica_0'] = (time.monotonic(), 0.0)
+
+        self.assertEqual(self.get_titles().get_json(), ['primary'])
+        self.assertTrue(self.router.stats()['replicas']['replica_0']['down'])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,79 @@
+import json
+import datetime
+import unittest
+
+from flask import Flask
+
+import serializers
+from serializers import ENCODERS, RawJSON, get_serializer, jsonify, \
+    set_encoder
+from models import Movie, Actor
+
+
+def make_movie(movie_id, title, release_date):
+    movie = Movie(title, release_date)
+    movie.id = movie_id
+    return movie
+
+
+class SerializersTestCase(unittest.TestCase):
+    """This class tests the JSON serialisation without a database"""
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.movies = [
+            make_movie(1, 'Plain', datetime.datetime(2001, 2, 3)),
+            make_movie(2, 'Quote " and é', None)
+        ]
+
+    def tearDown(self):
+        set_encoder(serializers.JSON_ENCODER)
+
+    def test_rows(self):
+        for encoder in ENCODERS:
+            set_encoder(encoder)
+            serializer = get_serializer(Movie)
+
+            self.assertEqual(json.loads(serializer.many(self.movies)), [
+                {'id': 1, 'title': 'Plain', 'release_date': '02/03/2001'},
+                {'id': 2, 'title': 'Quote " and é',
+                 'release_date': None}
+            ])
+            self.assertEqual(serializer.to_dict(self.movies[1]),
+                             json.loads(serializer.to_json(self.movies[1])))
+            self.assertEqual(self.movies[1].get_dict(('title',)),
+                             {'title': 'Quote " and é'})
+            self.assertEqual(json.loads(get_serializer(Actor).many([])), [])
+
+    def test_nested_raw_json(self):
+        rows = get_serializer(Movie, ('id',)).many(self.movies[:1])
+        for encoder in ENCODERS:
+            set_encoder(encoder)
+            self.assertEqual(json.loads(serializers.encode({
+                'pages': [rows, {'rows': rows}, (1, 'two')],
+                'total': 1
+            })), {'pages': [[{'id': 1}], {'rows': [{'id': 1}]}, [1, 'two']],
+                  'total': 1})
+
+    def test_jsonify(self):
+        set_encoder('stdlib')
+        with self.app.app_context():
+            response = jsonify({
+                'success': True,
+                'movies': get_serializer(Movie, ('id',)).many(self.movies),
+                'created_at': datetime.datetime(2001, 2, 3, 4, 5)
+            })
+            self.assertEqual(response.mimetype, 'application/json')
+            self.assertEqual(response.get_data(), b'{"success":true,'
+                             b'"movies":[{"id":1},{"id":2}],'
+                             b'"created_at":"2001-02-03T04:05:00"}\n')
+
+            self.app.config['JSONIFY_PRETTYPRINT_REGULAR'] = True
+            response = jsonify(success=True, movies=RawJSON(b'[]'))
+            self.assertEqual(response.get_data(),
+                             b'{\n  "success": true,\n  "movies": []\n}\n')
+
+
+# Make the tests conveniently executable
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,59 @@
+import os
+import sys
+import json
+import unittest
+import subprocess
+
+
+# seconds `import app` may take, the best of IMPORT_RUNS fresh interpreters
+IMPORT_TIME_BUDGET = float(os.environ.get('IMPORT_TIME_BUDGET', 1.0))
+IMPORT_RUNS = 3
+# loaded on first use: token verification, database driver, date parsing
+LAZY_MODULES = ('jose', 'rsa', 'ecdsa', 'psycopg2', 'dateutil')
+# environment variables read on first use only
+LAZY_SETTINGS = ('DATABASE_URL', 'AUTH0_DOMAIN', 'ALGORITHMS', 'API_AUDIENCE',
+                 'AUTH0_CLIENT_ID', 'AUTH0_CALLBACK_URL',
+                 'CASTING_ASSISTANT_TOKEN', 'EXECUTIVE_PRODUCER_TOKEN',
+                 'EXPIRED_TOKEN')
+
+IMPORT_SCRIPT = '''
+import sys, json, time
+start = time.perf_counter()
+import app
+print(json.dumps({
+    'seconds': time.perf_counter() - start,
+    'modules': sorted(sys.modules),
+    'app_created': 'app' in vars(app)
+}))
+'''
+
+
+def import_app():
+    '''Imports app in a fresh interpreter without the lazy settings'''
+    environ = {name: value for name, value in os.environ.items()
+               if name not in LAZY_SETTINGS}
+    output = subprocess.run(
+        [sys.executable, '-c', IMPORT_SCRIPT], env=environ,
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        stdout=subprocess.PIPE, check=True).stdout
+    return json.loads(output)
+
+
+class StartupTestCase(unittest.TestCase):
+    """This class tests what importing the app costs"""
+
+    def test_import_is_lazy(self):
+        result = import_app()
+        self.assertFalse(result['app_created'])
+        for module in LAZY_MODULES:
+            self.assertNotIn(module, result['modules'])
+
+    def test_import_time_budget(self):
+        seconds = min(import_app()['seconds'] for _ in range(IMPORT_RUNS))
+        self.assertLess(seconds, IMPORT_TIME_BUDGET,
+                        f'import app took {seconds * 1000:.0f}ms')
+
+
+# Make the tests conveniently executable
+if __name__ == "__main__":
+    unittest.main()